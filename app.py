@@ -1,130 +1,122 @@
 import gradio as gr
 import numpy as np
 
+import functools
+import logging
+import os
+import queue
 import spaces
-import torch
 import random
+import shutil
+import tempfile
+import time
 from PIL import Image
-from diffusers import FluxKontextPipeline
-from diffusers import FluxTransformer2DModel
-from diffusers.utils import load_image
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
 
-from huggingface_hub import hf_hub_download
+import image_io
+import metrics
+import pipeline
+from pipeline import LORA_WEIGHT, RelightRequest, SweepRequest
+from jobs import PRIORITIES, JobManager, QueueFull
+from prompts import DIRECTION_OPTIONS, ILLUMINATION_OPTIONS, build_prompt
+from resolution import ResolutionPolicy
+from result_cache import ResultCache
+from scheduler import INTERACTIVE, MicroBatchScheduler
 
-pipe = FluxKontextPipeline.from_pretrained("black-forest-labs/FLUX.1-Kontext-dev", torch_dtype=torch.bfloat16).to("cuda")
-pipe.load_lora_weights("kontext-community/relighting-kontext-dev-lora-v3", weight_name="relighting-kontext-dev-lora-v3.safetensors", adapter_name="lora")
-pipe.set_adapters(["lora"], adapter_weights=[0.75])
+# Concurrent requests with the same resolution are batched into one denoising call
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "4"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MAX_BATCH_WAIT_MS", "20"))
+# Results of identical requests (same pixels, prompt, seed, guidance and LoRA weight) are served from disk
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "result_cache")
+RESULT_CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB", "2048"))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "2000"))
+# Inputs are snapped to aspect-ratio buckets under this budget (in 1024x1024 units) instead of running at upload size
+MAX_MEGAPIXELS = float(os.environ.get("MAX_MEGAPIXELS", "1.0"))
+RESTORE_OUTPUT_SIZE = os.environ.get("RESTORE_OUTPUT_SIZE", "0") == "1"
+# Stream an approximate preview every N denoising steps, 0 disables previews
+PREVIEW_EVERY = int(os.environ.get("PREVIEW_EVERY", "4"))
+# Gradio only notices a client went away when the generator yields: without a preview for this long, yield
+# an empty update so abandoned requests are cancelled while queued or with previews disabled
+HEARTBEAT_SECONDS = 1.0
+# Responses are encoded here as OUTPUT_FORMAT ("jpeg", "webp" or "png") at OUTPUT_QUALITY, and the
+# "before" image is shrunk to BEFORE_PREVIEW_SIZE pixels on its longest side (0 sends it at full size)
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "relight-outputs"))
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "jpeg")
+OUTPUT_QUALITY = int(os.environ.get("OUTPUT_QUALITY", "90"))
+BEFORE_PREVIEW_SIZE = int(os.environ.get("BEFORE_PREVIEW_SIZE", "512"))
+# Largest number of preset/direction/seed combinations a single sweep may ask for
+MAX_SWEEP_VARIANTS = int(os.environ.get("MAX_SWEEP_VARIANTS", "16"))
+# Jobs submitted through the job API: queued plus running jobs above which submissions are rejected,
+# finished jobs kept for polling, and where their results are written
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", "32"))
+MAX_FINISHED_JOBS = int(os.environ.get("MAX_FINISHED_JOBS", "256"))
+JOB_RESULTS_DIR = os.path.abspath(os.environ.get("JOB_RESULTS_DIR", "job_results"))
+# Largest image upload accepted, from the UI and the job API alike
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "20"))
+# Run a first inference before accepting traffic
+WARM_UP = os.environ.get("WARM_UP", "0") == "1"
+# Set by ZeroGPU Spaces, where @spaces.GPU functions run in a forked worker that only plain data can reach
+ZERO_GPU = os.environ.get("SPACES_ZERO_GPU", "").lower() in ("1", "t", "true")
 
 MAX_SEED = np.iinfo(np.int32).max
 
-# Illumination options mapping
-ILLUMINATION_OPTIONS = {
-# Natural Daylight
-    "natural lighting": "Neutral white color temperature with balanced exposure and soft shadows",
-    "sunshine from window": "Bright directional sunlight with hard shadows and visible light rays",
-    "golden time": "Warm golden hour lighting with enhanced warm colors and soft shadows",
-    "sunrise in the mountains": "Warm backlighting with atmospheric haze and lens flare",
-    "afternoon light filtering through trees": "Dappled sunlight patterns with green color cast from foliage",
-    "early morning rays, forest clearing": "God rays through trees with warm color temperature",
-    "golden sunlight streaming through trees": "Golden god rays with atmospheric particles in light beams",
-    
-    # Sunset & Evening
-    "sunset over sea": "Warm sunset light with soft diffused lighting and gentle gradients",
-    "golden hour in a meadow": "Golden backlighting with lens flare and rim lighting",
-    "golden hour on a city skyline": "Golden lighting on buildings with silhouette effects",
-    "evening glow in the desert": "Warm directional lighting with long shadows",
-    "dusky evening on a beach": "Cool backlighting with horizon silhouettes",
-    "mellow evening glow on a lake": "Warm lighting with water reflections",
-    "warm sunset in a rural village": "Golden hour lighting with peaceful warm tones",
-    
-    # Night & Moonlight
-    "moonlight through curtains": "Cool blue lighting with curtain shadow patterns",
-    "moonlight in a dark alley": "Cool blue lighting with deep urban shadows",
-    "midnight in the forest": "Very low brightness with minimal ambient lighting",
-    "midnight sky with bright starlight": "Cool blue lighting with star point sources",
-    "fireflies lighting up a summer night": "Small glowing points with warm ambient lighting",
-    
-    # Indoor & Cozy
-    "warm atmosphere, at home, bedroom": "Very warm lighting with soft diffused glow",
-    "home atmosphere, cozy bedroom illumination": "Warm table lamp lighting with pools of light",
-    "cozy candlelight": "Warm orange flickering light with dramatic shadows",
-    "candle-lit room, rustic vibe": "Multiple warm candlelight sources with atmospheric shadows",
-    "night, cozy warm light from fireplace": "Warm orange-red firelight with flickering effects",
-    "campfire light": "Warm orange flickering light from below with dancing shadows",
-    
-    # Urban & Neon
-    "neon night, city": "Vibrant blue, magenta, and green neon lights with reflections",
-    "blue neon light, urban street": "Blue neon lighting with urban glow effects",
-    "neon, Wong Kar-wai, warm": "Warm amber and red neon with moody selective lighting",
-    "red and blue police lights in rain": "Alternating red and blue strobing with wet reflections",
-    "red glow, emergency lights": "Red emergency lighting with harsh shadows and high contrast",
-    
-    # Sci-Fi & Fantasy
-    "sci-fi RGB glowing, cyberpunk": "Electric blue, pink, and green RGB lighting with glowing effects",
-    "rainbow reflections, neon": "Chromatic rainbow patterns with prismatic reflections",
-    "magic lit": "Colored rim lighting in purple and blue with soft ethereal glow",
-    "mystical glow, enchanted forest": "Supernatural green and blue glowing with floating particles",
-    "ethereal glow, magical forest": "Supernatural lighting with blue-green rim lighting",
-    "underwater glow, deep sea": "Blue-green lighting with caustic patterns and particles",
-    "underwater luminescence": "Blue-green bioluminescent glow with caustic light patterns",
-    "aurora borealis glow, arctic landscape": "Green and purple dancing sky lighting",
-    "crystal reflections in a cave": "Sparkle effects with prismatic light dispersion",
-    
-    # Weather & Atmosphere
-    "foggy forest at dawn": "Volumetric fog with cool god rays through trees",
-    "foggy morning, muted light": "Soft fog effects with reduced contrast throughout",
-    "soft, diffused foggy glow": "Heavy fog with soft lighting and no harsh shadows",
-    "stormy sky lighting": "Dramatic lighting with high contrast and rim lighting",
-    "lightning flash in storm": "Brief intense white light with stark shadows",
-    "rain-soaked reflections in city lights": "Wet surface reflections with streaking light effects",
-    "gentle snowfall at dusk": "Cool blue lighting with snowflake particle effects",
-    "hazy light of a winter morning": "Neutral lighting with atmospheric haze",
-    "mysterious twilight, heavy mist": "Heavy fog with cool lighting and atmospheric depth",
-    
-    # Seasonal & Nature
-    "vibrant autumn lighting in a forest": "Enhanced warm autumn colors with dappled sunlight",
-    "purple and pink hues at twilight": "Warm lighting with soft purple and pink color grading",
-    "desert sunset with mirage-like glow": "Warm orange lighting with heat distortion effects",
-    "sunrise through foggy mountains": "Warm lighting through mist with atmospheric perspective",
-    
-    # Professional & Studio
-    "soft studio lighting": "Multiple diffused sources with even illumination and minimal shadows",
-    "harsh, industrial lighting": "Bright fluorescent lighting with hard shadows",
-    "fluorescent office lighting": "Cool white overhead lighting with slight green tint",
-    "harsh spotlight in dark room": "Single intense directional light with dramatic shadows",
-    
-    # Special Effects & Drama
-    "light and shadow": "Maximum contrast with sharp shadow boundaries",
-    "shadow from window": "Window frame shadow patterns with geometric shapes",
-    "apocalyptic, smoky atmosphere": "Orange-red fire tint with smoke effects",
-    "evil, gothic, in a cave": "Low brightness with cool lighting and deep shadows",
-    "flickering light in a haunted house": "Unstable flickering with cool and warm mixed lighting",
-    "golden beams piercing through storm clouds": "Dramatic god rays with high contrast",
-    "dim candlelight in a gothic castle": "Warm orange candlelight with stone texture enhancement",
-    
-    # Festival & Celebration
-    "colorful lantern light at festival": "Multiple colored lantern sources with bokeh effects",
-    "golden glow at a fairground": "Warm carnival lighting with colorful bulb effects",
-    "soft glow through stained glass": "Colored light filtering with rainbow surface patterns",
-    "glowing embers from a forge": "Orange-red glowing particles with intense heat effects"
-
-    }
-
-# Lighting direction options
-DIRECTION_OPTIONS = {
-    "auto": "",  
-    "left side": "Position the light source from the left side of the frame, creating shadows falling to the right.",
-    "right side": "Position the light source from the right side of the frame, creating shadows falling to the left.",
-    "top": "Position the light source from directly above, creating downward shadows.",
-    "top left": "Position the light source from the top left corner, creating diagonal shadows falling down and to the right.",
-    "top right": "Position the light source from the top right corner, creating diagonal shadows falling down and to the left.",
-    "bottom": "Position the light source from below, creating upward shadows and dramatic under-lighting.",
-    "front": "Position the light source from the front, minimizing shadows and creating even illumination.",
-    "back": "Position the light source from behind the subject, creating silhouette effects and rim lighting."
-}
+if ZERO_GPU:
+    # Previews and progress come back from the worker, cancellation stops at batches that have not started
+    run_batch = functools.partial(pipeline.relay_batch, spaces.GPU(pipeline.stream_batch))
+else:
+    run_batch = pipeline.run_batch
+scheduler = MicroBatchScheduler(run_batch, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT_MS / 1000)
+resolution_policy = ResolutionPolicy(max_megapixels=MAX_MEGAPIXELS, restore_size=RESTORE_OUTPUT_SIZE)
+result_cache = ResultCache(RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_MB * 1024**2, max_entries=RESULT_CACHE_MAX_ENTRIES)
+output_encoder = image_io.OutputEncoder(OUTPUT_DIR, format=OUTPUT_FORMAT, quality=OUTPUT_QUALITY)
+
+def _remove_job_result(job):
+    if job.result is not None and os.path.exists(job.result["image"]):
+        os.remove(job.result["image"])
+
+os.makedirs(JOB_RESULTS_DIR, exist_ok=True)
+job_manager = JobManager(workers=MAX_BATCH_SIZE, max_queued=MAX_QUEUED_JOBS, max_finished=MAX_FINISHED_JOBS, on_evict=_remove_job_result)
+
+def load_input(input_image, trace):
+    """
+    Decode an uploaded image (or its file path) and snap it to a resolution bucket.
+
+    Returns the decoded image, the bucketed one and the size of the upload. JPEGs are
+    decoded at a reduced scale that still covers the bucket, so the decoded image may be
+    smaller than the upload, unless the full-size "before" image is needed.
+    """
+    with trace.stage("decode"):
+        if not isinstance(input_image, Image.Image):
+            input_image = Image.open(input_image)
+        original_size = image_io.upright_size(input_image)
+        full_size = resolution_policy.restore_size and not BEFORE_PREVIEW_SIZE
+        input_image = image_io.open_image(input_image, fit=None if full_size else resolution_policy.bucket_for)
+    with trace.stage("convert"):
+        input_image = image_io.to_rgb(input_image)
+    with trace.stage("resize"):
+        original_image = input_image
+        input_image = resolution_policy.prepare(input_image)
+    return original_image, input_image, original_size
+
+def result_key(input_image, original_size, **params):
+    """Result cache key of the encoded output for `input_image` and the generation `params`"""
+    output_size = tuple(original_size) if resolution_policy.restore_size else input_image.size
+    return ResultCache.make_key(
+        input_image,
+        resolution=input_image.size,
+        output=(output_encoder.format, output_encoder.quality, output_size),
+        **pipeline.OUTPUT_SETTINGS,
+        **params,
+    )
+
+def encode_before(image):
+    """The "before" side of the result slider, shrunk to BEFORE_PREVIEW_SIZE and encoded once per request"""
+    if BEFORE_PREVIEW_SIZE:
+        image = image_io.downscale(image, BEFORE_PREVIEW_SIZE)
+    return output_encoder.encode(image)
 
-@spaces.GPU
-def infer(input_image, prompt, illumination_dropdown, direction_dropdown, seed=42, randomize_seed=False, guidance_scale=2.5, progress=gr.Progress(track_tqdm=True)):
+def infer(input_image, prompt, illumination_dropdown, direction_dropdown, seed=42, randomize_seed=False, guidance_scale=2.5, lora_scale=LORA_WEIGHT, progress=gr.Progress(track_tqdm=True), job=None):
     """
     Performs relighting on an input image using the FLUX.1-Kontext model.
     
@@ -137,7 +129,7 @@ def infer(input_image, prompt, illumination_dropdown, direction_dropdown, seed=4
     selection. The dropdowns serve as convenient presets to populate the prompt box.
     
     Args:
-        input_image (PIL.Image.Image): The input image to be relighted.
+        input_image (str or PIL.Image.Image): The input image to be relighted, or its file path.
         prompt (str): The detailed text description of the desired lighting effect.
                       If this is manually filled, it overrides the illumination dropdown.
         illumination_dropdown (str): A preset lighting style. See "Dropdown Options" below.
@@ -145,11 +137,18 @@ def infer(input_image, prompt, illumination_dropdown, direction_dropdown, seed=4
         seed (int): The seed for the random number generator for reproducibility.
         randomize_seed (bool): If True, a random seed is used, overriding the 'seed' value.
         guidance_scale (float): Controls how closely the model follows the prompt.
+        lora_scale (float): Strength of the relighting LoRA, 0.75 by default.
         progress (gr.Progress): A Gradio progress tracker for the UI.
+        job (jobs.Job): Set when running as a queued job: previews are skipped, and the
+            job's priority, progress and cancellation are used.
     
-    Returns:
-        tuple[list[PIL.Image.Image], int, str]: A tuple containing:
-            - A list with the input image (image[0]) and the relighted output image (image[1]).
+    While the model runs, low-resolution previews of the relit image are yielded every
+    PREVIEW_EVERY denoising steps; the last value yielded is the full-quality result.
+    
+    Yields:
+        tuple[list[str], int, str]: A tuple containing:
+            - A list with the paths of the input image, downscaled to BEFORE_PREVIEW_SIZE
+              (image[0]), and of the relighted output image (image[1]), encoded as OUTPUT_FORMAT.
             - The seed used for the generation.
             - The final constructed prompt string used by the model.
     
@@ -263,39 +262,267 @@ def infer(input_image, prompt, illumination_dropdown, direction_dropdown, seed=4
     """
     if randomize_seed:
         seed = random.randint(0, MAX_SEED)
-        
-    input_image = input_image.convert("RGB")
-
-    #If the dropdown isn't custom, and the user didn't specify a prompt, fill the prompt with the correct one from the illumination options
-    if illumination_dropdown != "custom" and prompt == "":
-        prompt = ILLUMINATION_OPTIONS[illumination_dropdown]
-
-    #If the prompt matches the illumination options, prefix that
-    if illumination_dropdown != "custom" and prompt == ILLUMINATION_OPTIONS[illumination_dropdown]:
-        prompt_prefix = f", with {illumination_dropdown}"
-    #If the prompt was changed, the prefix is empty as the user prompt is predominant
-    else:
-        prompt_prefix = ""
-
-    # If direction isn't auto, add the direction suffix
-    if direction_dropdown != "auto" and prompt_prefix != "":
-        prompt_prefix = prompt_prefix + f"coming from the {direction_dropdown} of the image"
-    elif direction_dropdown != "auto" and prompt_prefix == "":
-        prompt_prefix = f", light coming from the {direction_dropdown} of the image"
     
-    prompt_with_template = f"Relight the image{prompt_prefix}. {prompt} Maintain the identity of the foreground subjects."
+    trace = metrics.trace()
+    # CPU time is measured per synchronous segment, Gradio may resume the generator on another thread
+    cpu_start = time.thread_time()
+    original_image, input_image, original_size = load_input(input_image, trace)
+
+    prompt_with_template = build_prompt(prompt, illumination_dropdown, direction_dropdown)
     
-    print(prompt_with_template)
+    # A freshly drawn seed can't match a previous request, so randomized runs never touch the cache
+    cache_key = None
+    encoded = None
+    image = None
+    if not randomize_seed:
+        with trace.stage("cache_lookup"):
+            cache_key = result_key(input_image, original_size, prompt=prompt_with_template, seed=seed, guidance_scale=guidance_scale, lora_weight=lora_scale)
+            encoded = result_cache.get(cache_key)
+    cache_hit = encoded is not None
+    with trace.stage("output"):
+        before_path, response_bytes = encode_before(original_image if resolution_policy.restore_size else input_image)
+    cpu_seconds = time.thread_time() - cpu_start
     
-    image = pipe(
-        image=input_image, 
+    if not cache_hit:
+        previews = queue.Queue()
+        request = RelightRequest(
+            input_image,
+            prompt_with_template,
+            seed,
+            guidance_scale,
+            lora_weight=lora_scale,
+            trace=trace,
+            on_preview=lambda preview, step: previews.put(preview),
+            preview_every=PREVIEW_EVERY if job is None else 0,
+        )
+        if job is not None:
+            request.on_step = job.set_progress
+            request.cancelled = job.cancelled
+        future = scheduler.submit(request, key=(input_image.size, guidance_scale, lora_scale), priority=INTERACTIVE if job is None else job.priority)
+        try:
+            # Stream approximate previews until the full-quality image is ready
+            last_yield = time.monotonic()
+            while not future.done():
+                try:
+                    preview = previews.get(timeout=0.1)
+                except queue.Empty:
+                    if job is None and time.monotonic() - last_yield >= HEARTBEAT_SECONDS:
+                        last_yield = time.monotonic()
+                        yield gr.skip(), gr.skip(), gr.skip()
+                    continue
+                last_yield = time.monotonic()
+                yield [before_path, preview], seed, prompt_with_template
+            image = future.result()
+        finally:
+            # The client disconnected (Gradio closed the generator), skip the remaining steps
+            if not future.done():
+                request.cancelled.set()
+                future.cancel()
+    cpu_start = time.thread_time()
+    with trace.stage("output"):
+        # Hits are served as cached, misses are encoded once and cached from a background thread
+        if not cache_hit:
+            encoded = output_encoder.to_bytes(resolution_policy.finalize(image, original_size))
+            if cache_key is not None:
+                result_cache.put(cache_key, encoded)
+        output_path, output_bytes = output_encoder.write(encoded)
+        images = [before_path, output_path]
+        response_bytes += output_bytes
+    cpu_seconds += time.thread_time() - cpu_start
+    trace.finish(
         prompt=prompt_with_template,
+        seed=seed,
+        guidance_scale=guidance_scale,
+        resolution=input_image.size,
+        cache_hit=cache_hit,
+        response_bytes=response_bytes,
+        cpu_seconds=round(cpu_seconds, 4),
+    )
+    if job is not None:
+        job.stages = dict(getattr(trace, "stages", {}))
+    yield images, seed, prompt_with_template
+
+def _relight_job(job, *args):
+    for images, seed, prompt in infer(*args, job=job):
+        pass
+    path = os.path.join(JOB_RESULTS_DIR, job.id + os.path.splitext(images[1])[1])
+    shutil.copyfile(images[1], path)
+    return {"image": path, "seed": seed, "prompt": prompt}
+
+def _uploaded_path(file):
+    """Path of a file uploaded to Gradio, refusing anything outside its upload folder"""
+    path = file.path if isinstance(file, gr.FileData) else file.get("path") if isinstance(file, dict) else None
+    if not path:
+        raise gr.Error("input_image must be an uploaded file")
+    path = os.path.realpath(path)
+    upload_folder = os.path.realpath(gr.utils.get_upload_folder())
+    if os.path.commonpath([path, upload_folder]) != upload_folder or not os.path.isfile(path):
+        raise gr.Error("input_image must be an uploaded file")
+    if os.path.getsize(path) > MAX_UPLOAD_MB * 1024**2:
+        raise gr.Error(f"input_image is larger than {MAX_UPLOAD_MB}MB")
+    return path
+
+def submit_job(input_image: gr.FileData, prompt: str = "", illumination_dropdown: str = "sunshine from window", direction_dropdown: str = "auto", seed: int = 42, randomize_seed: bool = False, guidance_scale: float = 2.5, lora_scale: float = LORA_WEIGHT, priority: str = "bulk") -> dict:
+    """
+    Queues a relighting job and returns immediately with its id, see `infer` for the parameters.
+
+    Poll `job_status` with the id until its state is "done", then fetch the image with
+    `job_result`. Submissions are rejected while the queue is full, retry later.
+
+    Args:
+        input_image (gradio.FileData): The image to relight, uploaded through the Gradio
+            client. URLs and server-side paths are rejected.
+        priority (str): "interactive" jobs run before "bulk" ones.
+
+    Returns:
+        dict: The job status, including its "id".
+    """
+    if priority not in PRIORITIES:
+        raise gr.Error(f"priority must be one of {', '.join(PRIORITIES)}")
+    input_image = _uploaded_path(input_image)
+    try:
+        job = job_manager.submit(
+            _relight_job, input_image, prompt, illumination_dropdown, direction_dropdown, seed, randomize_seed, guidance_scale, lora_scale,
+            priority=PRIORITIES[priority],
+        )
+    except QueueFull:
+        raise gr.Error("Too many queued jobs, retry later")
+    return job.status()
+
+def _get_job(job_id):
+    try:
+        return job_manager.get(job_id)
+    except KeyError:
+        raise gr.Error(f"Unknown or expired job {job_id}")
+
+def job_status(job_id: str) -> dict:
+    """State ("queued", "running", "done", "failed" or "cancelled"), progress between 0 and 1 and timings of a job"""
+    return _get_job(job_id).status()
+
+def job_result(job_id: str) -> dict:
+    """
+    Result of a finished job: the status plus "image", the server path of the relit image
+    (download it from /gradio_api/file=<path>), and the "seed" and "prompt" used.
+    """
+    job = _get_job(job_id)
+    if job.state != "done":
+        raise gr.Error(f"Job {job_id} is {job.state}")
+    return {**job.status(), **job.result}
+
+def cancel_job(job_id: str) -> dict:
+    """Cancels a queued or running job, a running relight stops at its next denoising step"""
+    _get_job(job_id)
+    job_manager.cancel(job_id)
+    return job_status(job_id)
+
+def sweep(input_image, illuminations, directions, seed=42, randomize_seed=False, seeds_per_variant=1, guidance_scale=2.5, lora_scale=LORA_WEIGHT, progress=gr.Progress(track_tqdm=True)):
+    """
+    Relights one image with every combination of the chosen lighting styles, directions and seeds.
+
+    The image is encoded once and its latents are shared by all variants, which run
+    batched in as few denoising calls as GPU memory allows. Much faster than calling
+    `infer` once per variant.
+
+    Args:
+        input_image (str or PIL.Image.Image): The input image to be relighted, or its file path.
+        illuminations (list[str]): Preset lighting styles, see the options of `infer`.
+        directions (list[str]): Light directions, see the options of `infer`.
+        seed (int): Seed of the first variant of each combination.
+        randomize_seed (bool): If True, a random seed is used, overriding the 'seed' value.
+        seeds_per_variant (int): Number of consecutive seeds, starting at 'seed', run for
+            each lighting style and direction.
+        guidance_scale (float): Controls how closely the model follows the prompt.
+        lora_scale (float): Strength of the relighting LoRA, 0.75 by default.
+        progress (gr.Progress): A Gradio progress tracker for the UI.
+
+    Yields:
+        tuple[list[tuple[str, str]], int]: The paths of the relit images, encoded as
+            OUTPUT_FORMAT and captioned with their lighting style, direction and seed, and
+            the first seed used. Empty updates are yielded while the variants run, the
+            last value is the result.
+    """
+    illuminations = [illumination for illumination in illuminations if illumination != "custom"]
+    directions = directions or ["auto"]
+    seeds_per_variant = int(seeds_per_variant)
+    if not illuminations:
+        raise gr.Error("Choose at least one lighting style")
+    if len(illuminations) * len(directions) * seeds_per_variant > MAX_SWEEP_VARIANTS:
+        raise gr.Error(f"A sweep is limited to {MAX_SWEEP_VARIANTS} variants")
+    if randomize_seed:
+        seed = random.randint(0, MAX_SEED - seeds_per_variant)
+
+    trace = metrics.trace()
+    cpu_start = time.thread_time()
+    original_image, input_image, original_size = load_input(input_image, trace)
+    variants = [
+        (illumination, direction, seed + offset, build_prompt("", illumination, direction))
+        for illumination in illuminations
+        for direction in directions
+        for offset in range(seeds_per_variant)
+    ]
+
+    # Variants already relit by earlier requests come from the result cache, only the others are run.
+    # As in `infer`, freshly drawn seeds can't match a previous request and never touch the cache
+    keys = [None] * len(variants)
+    encoded = [None] * len(variants)
+    if not randomize_seed:
+        with trace.stage("cache_lookup"):
+            keys = [
+                result_key(input_image, original_size, prompt=prompt, seed=variant_seed, guidance_scale=guidance_scale, lora_weight=lora_scale)
+                for _, _, variant_seed, prompt in variants
+            ]
+            encoded = [result_cache.get(key) for key in keys]
+    missing = [i for i, data in enumerate(encoded) if data is None]
+    images = {}
+    cpu_seconds = time.thread_time() - cpu_start
+    if missing:
+        steps = queue.Queue()
+        request = SweepRequest(
+            input_image,
+            [(variants[i][3], variants[i][2]) for i in missing],
+            guidance_scale,
+            lora_weight=lora_scale,
+            trace=trace,
+            on_step=lambda steps_done, total_steps: steps.put(steps_done / total_steps),
+        )
+        future = scheduler.submit(request, key=("sweep", id(request)))
+        try:
+            # As in `infer`, yielding lets Gradio cancel the sweep once the client went away
+            last_yield = time.monotonic()
+            while not future.done():
+                try:
+                    progress(steps.get(timeout=0.1), desc="Relighting")
+                except queue.Empty:
+                    pass
+                if time.monotonic() - last_yield >= HEARTBEAT_SECONDS:
+                    last_yield = time.monotonic()
+                    yield gr.skip(), gr.skip()
+            for i, image in zip(missing, future.result()):
+                images[i] = image
+        finally:
+            if not future.done():
+                request.cancelled.set()
+                future.cancel()
+
+    cpu_start = time.thread_time()
+    with trace.stage("output"):
+        for i in missing:
+            encoded[i] = output_encoder.to_bytes(resolution_policy.finalize(images[i], original_size))
+            if keys[i] is not None:
+                result_cache.put(keys[i], encoded[i])
+        written = [output_encoder.write(data) for data in encoded]
+        gallery = [(path, f"{illumination}, {direction}, seed {variant_seed}") for (path, _), (illumination, direction, variant_seed, _) in zip(written, variants)]
+    cpu_seconds += time.thread_time() - cpu_start
+    trace.finish(
+        sweep_variants=len(variants),
+        cache_hits=len(variants) - len(missing),
+        seed=seed,
         guidance_scale=guidance_scale,
-        width=input_image.size[0],
-        height=input_image.size[1],
-        generator=torch.Generator().manual_seed(seed),
-    ).images[0]
-    return [input_image, image], seed, prompt_with_template
+        resolution=input_image.size,
+        response_bytes=sum(size for _, size in written),
+        cpu_seconds=round(cpu_seconds, 4),
+    )
+    yield gallery, seed
 
 def update_prompt_from_dropdown(illumination_option):
     """Update the prompt textbox based on dropdown selection"""
@@ -304,6 +531,23 @@ def update_prompt_from_dropdown(illumination_option):
     else:
         return ILLUMINATION_OPTIONS[illumination_option]
 
+def cache_stats() -> dict:
+    """Hit and miss counters of the prompt embedding and result caches"""
+    return {"prompt_embeddings": pipeline.get_prompt_cache().stats(), "results": result_cache.stats()}
+
+metrics.REGISTRY.add_collector(lambda: {
+    f"relight_{tier}_cache_{name}": value
+    for tier, stats in cache_stats().items()
+    for name, value in stats.items()
+})
+metrics.REGISTRY.add_collector(lambda: {f"relight_jobs_{name}": value for name, value in job_manager.stats().items()})
+metrics.REGISTRY.add_collector(lambda: {f"relight_{component}_weight_bytes": value for component, value in pipeline.WEIGHT_BYTES.items()})
+
+
+def metrics_endpoint(request):
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 css="""
 #col-container {
     margin: 0 auto;
@@ -321,7 +565,7 @@ with gr.Blocks(css=css) as demo:
 
         with gr.Row():
             with gr.Column():
-                input_image = gr.Image(label="Upload the image for relighting", type="pil")
+                input_image = gr.Image(label="Upload the image for relighting", type="filepath")
                 
                 with gr.Row():
                     
@@ -369,7 +613,15 @@ with gr.Blocks(css=css) as demo:
                         maximum=10,
                         step=0.1,
                         value=2.5,
-                    )       
+                    )
+                    
+                    lora_scale = gr.Slider(
+                        label="LoRA Strength",
+                        minimum=0,
+                        maximum=1.5,
+                        step=0.05,
+                        value=LORA_WEIGHT,
+                    )
                     
             with gr.Column():
                 result = gr.ImageSlider(label="Result", show_label=False, interactive=False)
@@ -383,28 +635,81 @@ with gr.Blocks(css=css) as demo:
         
         gr.Examples(
             examples=[
-                ["./assets/pexels-creationhill-1681010.jpg", "Add multiple colored light sources from lanterns. Create warm festival lighting. Set varied color temperatures. Add bokeh effects.", "colorful lantern light at festival", "auto", 0, True, 2.5],
-                ["./assets/pexels-creationhill-1681010.jpg",  "add futuristic RGB lighting with electric blues, hot pinks, and neon greens creating a high-tech atmosphere with dramatic color separation and glowing effects", "sci-fi RGB glowing, cyberpunk", "left side", 0, True, 2.5],
-                ["./assets/pexels-moose-photos-170195-1587009.jpg",  "Set blue-green color temperature. Add volumetric lighting effects. Reduce red channel significantly. Create particle effects in light beams. Add caustic light patterns.", "underwater glow, deep sea", "top", 0, True, 2.5],
-                ["./assets/pexels-moose-photos-170195-1587009.jpg", "Replace lighting with red sources. Add flashing strobing effects. Increase contrast. Create harsh shadows. Set monochromatic red color scheme.", "red glow, emergency lights", "right side", 0, True, 2.5],
-                ["./assets/pexels-simon-robben-55958-614810.jpg",  "Add directional sunlight from window source. Increase brightness on lit areas. Create hard shadows with sharp edges. Set warm white color temperature. Add visible light rays and dust particles in beams.", "sunshine from window", "top right", 0, True, 2.5],
-                ["./assets/pexels-simon-robben-55958-614810.jpg", "add vibrant neon lights in electric blues, magentas, and greens casting colorful reflections on surfaces, creating a cyberpunk urban atmosphere with dramatic color contrasts", "neon night, city", "top left", 0, True, 2.5],
-                ["./assets/pexels-freestockpro-1227513.jpg",  "warm lighting with soft purple and pink color grading", "purple and pink hues at twilight", "auto", 0, True, 2.5],
-                ["./assets/pexels-pixabay-158827.jpg", "Soft fog effects with reduced contrast throughout", "foggy morning, muted light", "auto", 0, True, 2.5],
-                ["./assets/pexels-pixabay-355465.jpg", "daylight, bright sunshine", "custom", "auto", 0, True, 2.5]           
+                ["./assets/pexels-creationhill-1681010.jpg", "Add multiple colored light sources from lanterns. Create warm festival lighting. Set varied color temperatures. Add bokeh effects.", "colorful lantern light at festival", "auto", 0, True, 2.5, LORA_WEIGHT],
+                ["./assets/pexels-creationhill-1681010.jpg",  "add futuristic RGB lighting with electric blues, hot pinks, and neon greens creating a high-tech atmosphere with dramatic color separation and glowing effects", "sci-fi RGB glowing, cyberpunk", "left side", 0, True, 2.5, LORA_WEIGHT],
+                ["./assets/pexels-moose-photos-170195-1587009.jpg",  "Set blue-green color temperature. Add volumetric lighting effects. Reduce red channel significantly. Create particle effects in light beams. Add caustic light patterns.", "underwater glow, deep sea", "top", 0, True, 2.5, LORA_WEIGHT],
+                ["./assets/pexels-moose-photos-170195-1587009.jpg", "Replace lighting with red sources. Add flashing strobing effects. Increase contrast. Create harsh shadows. Set monochromatic red color scheme.", "red glow, emergency lights", "right side", 0, True, 2.5, LORA_WEIGHT],
+                ["./assets/pexels-simon-robben-55958-614810.jpg",  "Add directional sunlight from window source. Increase brightness on lit areas. Create hard shadows with sharp edges. Set warm white color temperature. Add visible light rays and dust particles in beams.", "sunshine from window", "top right", 0, True, 2.5, LORA_WEIGHT],
+                ["./assets/pexels-simon-robben-55958-614810.jpg", "add vibrant neon lights in electric blues, magentas, and greens casting colorful reflections on surfaces, creating a cyberpunk urban atmosphere with dramatic color contrasts", "neon night, city", "top left", 0, True, 2.5, LORA_WEIGHT],
+                ["./assets/pexels-freestockpro-1227513.jpg",  "warm lighting with soft purple and pink color grading", "purple and pink hues at twilight", "auto", 0, True, 2.5, LORA_WEIGHT],
+                ["./assets/pexels-pixabay-158827.jpg", "Soft fog effects with reduced contrast throughout", "foggy morning, muted light", "auto", 0, True, 2.5, LORA_WEIGHT],
+                ["./assets/pexels-pixabay-355465.jpg", "daylight, bright sunshine", "custom", "auto", 0, True, 2.5, LORA_WEIGHT]           
             ],
-            inputs=[input_image, prompt, illumination_dropdown, direction_dropdown, seed, randomize_seed, guidance_scale],
+            inputs=[input_image, prompt, illumination_dropdown, direction_dropdown, seed, randomize_seed, guidance_scale, lora_scale],
             outputs=[result, seed, final_prompt],
             fn=infer,
             cache_examples="lazy"
         )
+        
+        with gr.Accordion("Preset Sweep", open=False):
+            gr.Markdown("Relight the uploaded image with several lighting styles and directions at once, using the seed and settings above.")
+            with gr.Row():
+                sweep_illuminations = gr.Dropdown(
+                    choices=list(ILLUMINATION_OPTIONS.keys()),
+                    value=["sunshine from window", "neon night, city", "cozy candlelight"],
+                    multiselect=True,
+                    label="Lighting Styles",
+                    scale=2
+                )
+                sweep_directions = gr.Dropdown(
+                    choices=list(DIRECTION_OPTIONS.keys()),
+                    value=["auto"],
+                    multiselect=True,
+                    label="Light Directions",
+                    scale=1
+                )
+                seeds_per_variant = gr.Slider(
+                    label="Seeds per variant",
+                    minimum=1,
+                    maximum=4,
+                    step=1,
+                    value=1,
+                    scale=1
+                )
+            sweep_button = gr.Button("Run sweep")
+            sweep_gallery = gr.Gallery(label="Sweep", columns=4, height="auto")
+
+        gr.api(cache_stats, api_name="cache_stats")
+        gr.api(submit_job, api_name="submit_job")
+        gr.api(job_status, api_name="job_status")
+        gr.api(job_result, api_name="job_result")
+        gr.api(cancel_job, api_name="cancel_job")
+
+        sweep_button.click(
+            fn=sweep,
+            inputs=[input_image, sweep_illuminations, sweep_directions, seed, randomize_seed, seeds_per_variant, guidance_scale, lora_scale],
+            outputs=[sweep_gallery, seed],
+            api_name="sweep",
+            concurrency_limit=1
+        )
     
         gr.on(
             triggers=[run_button.click, prompt.submit],
             fn = infer,
-            inputs = [input_image, prompt, illumination_dropdown, direction_dropdown, seed, randomize_seed, guidance_scale],
-            outputs = [result, seed, final_prompt]
+            inputs = [input_image, prompt, illumination_dropdown, direction_dropdown, seed, randomize_seed, guidance_scale, lora_scale],
+            outputs = [result, seed, final_prompt],
+            concurrency_limit=MAX_BATCH_SIZE
         )
     
 
-demo.launch(mcp_server=True)
\ No newline at end of file
+if __name__ == "__main__":
+    # Per-request timings are written as one JSON line each
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger("relight").setLevel(logging.INFO)
+    # ZeroGPU expects the weights to be loaded in the main process before launch
+    pipeline.get_pipeline()
+    if WARM_UP:
+        pipeline.warm_up()
+    print("Cold start:", ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in pipeline.COLD_START.items()))
+    print("Weights:", ", ".join(f"{component} {size / 1024**3:.1f}GB" for component, size in pipeline.WEIGHT_BYTES.items()), f"({pipeline.QUANTIZATION or 'bfloat16'})")
+    demo.launch(mcp_server=True, allowed_paths=[JOB_RESULTS_DIR], max_file_size=f"{MAX_UPLOAD_MB}mb", app_kwargs={"routes": [Route("/metrics", metrics_endpoint)]})
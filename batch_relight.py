@@ -0,0 +1,232 @@
+"""
+Relight a whole directory (or manifest) of images without the Gradio UI.
+
+    python batch_relight.py photos/ --output-dir relit/ --illumination "soft studio lighting" --direction "top left"
+
+Inputs are decoded and bucketed on a thread pool ahead of the GPU and outputs are written
+by a background thread. Every finished image is appended to `<output-dir>/manifest.jsonl`,
+so rerunning the same command after an interruption only processes what is left.
+Pass `--stub` to run the whole loop on CPU without loading the model.
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import image_io
+import pipeline
+from pipeline import RelightRequest
+from prompts import DIRECTION_OPTIONS, ILLUMINATION_OPTIONS, build_prompt
+from resolution import ResolutionPolicy
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def list_inputs(source):
+    """Return `(input_path, relative_output_name)` pairs from a directory or a text manifest"""
+    if os.path.isdir(source):
+        items = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    path = os.path.join(root, name)
+                    items.append((path, os.path.splitext(os.path.relpath(path, source))[0] + ".png"))
+        return sorted(items)
+    # A manifest lists one image path per line, relative to the manifest itself
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [
+        (os.path.join(base, path), f"{index:06d}_{os.path.splitext(os.path.basename(path))[0]}.png")
+        for index, path in enumerate(paths)
+    ]
+
+
+def load_done(output_dir):
+    """Inputs already relit by a previous run, read from the progress manifest"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be truncated if the previous run was killed mid-write
+                continue
+            if os.path.exists(os.path.join(output_dir, entry["output"])):
+                done.add(entry["input"])
+    return done
+
+
+class Writer:
+    """Saves outputs and records them in the manifest on a background thread"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.manifest = open(os.path.join(output_dir, MANIFEST_NAME), "a+")
+        # A run killed mid-write leaves a truncated last line, the next entry must not be glued to it
+        if self.manifest.tell():
+            self.manifest.seek(self.manifest.tell() - 1)
+            if self.manifest.read(1) != "\n":
+                self.manifest.write("\n")
+        self.queue = queue.Queue(maxsize=64)
+        self.error = None
+        self.thread = threading.Thread(target=self._loop, name="relight-writer", daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            image, entry = item
+            try:
+                path = os.path.join(self.output_dir, entry["output"])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                image.save(path)
+                self.manifest.write(json.dumps(entry) + "\n")
+                self.manifest.flush()
+            except Exception as e:
+                self.error = e
+
+    def put(self, image, entry):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((image, entry))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.manifest.close()
+        if self.error is not None:
+            raise self.error
+
+
+def relight_directory(
+    source,
+    output_dir,
+    illumination="natural lighting",
+    direction="auto",
+    prompt="",
+    seed=0,
+    guidance_scale=2.5,
+    batch_size=4,
+    workers=4,
+    max_megapixels=1.0,
+    log=print,
+):
+    """
+    Relight every image of `source` into `output_dir`, skipping images already done.
+
+    Returns the number of images processed by this run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    prompt_with_template = build_prompt(prompt, illumination, direction)
+    policy = ResolutionPolicy(max_megapixels=max_megapixels)
+
+    done = load_done(output_dir)
+    items = [(path, name) for path, name in list_inputs(source) if path not in done]
+    total = len(items)
+    log(f"{len(done)} already done, {total} to relight with: {prompt_with_template}")
+    if not items:
+        return 0
+
+    def decode(path):
+        with Image.open(path) as image:
+            # Upright per EXIF, with JPEGs decoded straight at a reduced scale that still covers the bucket
+            return policy.prepare(image_io.to_rgb(image_io.open_image(image, fit=policy.bucket_for)))
+
+    writer = Writer(output_dir)
+    processed = 0
+    start = time.perf_counter()
+
+    def flush(batch):
+        nonlocal processed
+        requests = [RelightRequest(image, prompt_with_template, seed, guidance_scale) for image, _, _ in batch]
+        for output, (_, path, name) in zip(pipeline.run_batch(requests), batch):
+            writer.put(output, {"input": path, "output": name, "prompt": prompt_with_template, "seed": seed, "guidance_scale": guidance_scale})
+        processed += len(batch)
+        elapsed = time.perf_counter() - start
+        rate = processed / elapsed
+        log(f"{processed}/{total} images, {rate:.2f} images/sec, ETA {(total - processed) / rate:.0f}s")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Keep a bounded number of decodes in flight ahead of the GPU
+            pending = deque()
+            batches = {}
+            items_iter = iter(items)
+
+            def prefetch():
+                item = next(items_iter, None)
+                if item is not None:
+                    pending.append((pool.submit(decode, item[0]), *item))
+
+            for _ in range(workers * 2):
+                prefetch()
+            while pending:
+                future, path, name = pending.popleft()
+                prefetch()
+                try:
+                    image = future.result()
+                except OSError as e:
+                    log(f"Skipping {path}: {e}")
+                    continue
+                # Only images of the same bucket can share a denoising call
+                batch = batches.setdefault(image.size, [])
+                batch.append((image, path, name))
+                if len(batch) >= batch_size:
+                    flush(batches.pop(image.size))
+            for batch in batches.values():
+                flush(batch)
+    finally:
+        writer.close()
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relight a directory or manifest of images with FLUX.1-Kontext")
+    parser.add_argument("source", help="Directory of images, or a text file listing one image path per line")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--illumination", default="natural lighting", choices=["custom"] + list(ILLUMINATION_OPTIONS))
+    parser.add_argument("--direction", default="auto", choices=list(DIRECTION_OPTIONS))
+    parser.add_argument("--prompt", default="", help="Custom lighting description, overrides the illumination preset")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--guidance-scale", type=float, default=2.5)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=4, help="Decode threads")
+    parser.add_argument("--max-megapixels", type=float, default=1.0)
+    parser.add_argument("--stub", action="store_true", help="Use a CPU stub instead of the model")
+    args = parser.parse_args(argv)
+
+    if args.illumination == "custom" and not args.prompt:
+        parser.error("--prompt is required with --illumination custom")
+    if args.stub:
+        pipeline.set_pipeline(pipeline.StubPipeline())
+
+    relight_directory(
+        args.source,
+        args.output_dir,
+        illumination=args.illumination,
+        direction=args.direction,
+        prompt=args.prompt,
+        seed=args.seed,
+        guidance_scale=args.guidance_scale,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        max_megapixels=args.max_megapixels,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
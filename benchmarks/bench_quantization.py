@@ -0,0 +1,129 @@
+"""
+Weight-only quantization checks and costs on a tiny transformer.
+
+    python benchmarks/bench_quantization.py            # tiny random transformer on CPU
+    python benchmarks/bench_quantization.py --layers 4 --heads 8
+
+For bfloat16, int8 and int4 this prints the weight bytes, the load time from a
+quantized checkpoint and the step latency. It also checks:
+
+- every quantized weight dequantizes back within one quantization step of the
+  original (half a step from rounding, plus clamping where the scale was rounded down);
+- the transformer loaded from the checkpoint written by `quantization.load_quantized`
+  gives exactly the same output as the one quantized in memory;
+- a LoRA attached with PEFT changes the output of the quantized transformer as much as
+  it changes the bfloat16 one, within `--lora-rtol`;
+- the quantized output stays within `--rtol` of the bfloat16 one.
+
+Exits with status 1 when a check fails.
+"""
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import time
+
+import torch
+from peft import LoraConfig
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from quantization import GROUP_SIZE, MODES, QuantizedLinear, dequantize_weight, load_quantized, model_bytes  # noqa: E402
+from tiny import LORA_TARGET_MODULES, tiny_transformer, transformer_inputs  # noqa: E402
+
+PREFIXES = ("transformer_blocks.", "single_transformer_blocks.")
+
+
+@torch.no_grad()
+def step_seconds(transformer, inputs, repeats):
+    transformer(**inputs)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        transformer(**inputs)
+    return (time.perf_counter() - start) / repeats
+
+
+def relative_error(output, reference):
+    return ((output.float() - reference.float()).abs().mean() / reference.float().abs().mean()).item()
+
+
+@torch.no_grad()
+def round_trip_error(original, quantized):
+    """Largest error of a dequantized weight, in quantization steps"""
+    originals = dict(original.named_modules())
+    worst = 0.0
+    for name, module in quantized.named_modules():
+        if not isinstance(module, QuantizedLinear):
+            continue
+        weight = dequantize_weight(module.qweight, module.scale, module.mode, torch.float32)
+        error = (weight - originals[name].weight.float()).abs()
+        # One scale per row for int8, per group of GROUP_SIZE columns for int4
+        scale = module.scale.float()
+        step = scale.expand(-1, error.shape[1]) if module.mode == "int8" else scale.expand(-1, -1, GROUP_SIZE).reshape(error.shape)
+        worst = max(worst, (error / step).max().item())
+    return worst
+
+
+def with_lora(transformer, rank):
+    transformer = copy.deepcopy(transformer)
+    torch.manual_seed(1)
+    transformer.add_adapter(LoraConfig(r=rank, lora_alpha=rank, target_modules=LORA_TARGET_MODULES, init_lora_weights=False), adapter_name="lora")
+    return transformer
+
+
+@torch.no_grad()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--heads", type=int, default=4)
+    parser.add_argument("--head-dim", type=int, default=32)
+    parser.add_argument("--size", type=int, default=16, help="Latent side in tokens")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--rtol", type=float, default=0.1, help="Tolerated output error relative to bfloat16")
+    parser.add_argument("--lora-rtol", type=float, default=0.1, help="Tolerated error of the LoRA contribution")
+    args = parser.parse_args(argv)
+
+    def build():
+        return tiny_transformer(num_layers=args.layers, num_single_layers=args.layers, attention_head_dim=args.head_dim, num_attention_heads=args.heads)
+
+    original = build().to(torch.bfloat16)
+    inputs = transformer_inputs(original, height=args.size, width=args.size)
+    inputs = {name: value.to(torch.bfloat16) if torch.is_tensor(value) and value.is_floating_point() else value for name, value in inputs.items()}
+    reference = original(**inputs)[0]
+    original_lora = with_lora(original, 4)
+    reference_lora_delta = original_lora(**inputs)[0].float() - reference.float()
+    print(f"bfloat16: {model_bytes(original) / 1024:.0f}KiB, step {step_seconds(original, inputs, args.repeats) * 1000:.2f}ms")
+
+    failures = 0
+    cache_dir = tempfile.mkdtemp(prefix="relight-quantized-")
+    for mode in MODES:
+        path = os.path.join(cache_dir, f"transformer-{mode}.safetensors")
+        start = time.perf_counter()
+        quantized = load_quantized(path, lambda: copy.deepcopy(original), build, mode, PREFIXES)
+        quantize_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = load_quantized(path, None, build, mode, PREFIXES)
+        load_seconds = time.perf_counter() - start
+
+        output = quantized(**inputs)[0]
+        checks = {
+            "round trip": round_trip_error(original, quantized) <= 1.0,
+            "checkpoint": torch.equal(loaded(**inputs)[0], output),
+            "output": relative_error(output, reference) <= args.rtol,
+        }
+        lora_delta = with_lora(quantized, 4)(**inputs)[0].float() - output.float()
+        checks["lora"] = relative_error(lora_delta, reference_lora_delta) <= args.lora_rtol
+        failures += not all(checks.values())
+
+        print(
+            f"{mode}: {model_bytes(quantized) / 1024:.0f}KiB, quantize+save {quantize_seconds:.2f}s, load {load_seconds:.2f}s, "
+            f"step {step_seconds(quantized, inputs, args.repeats) * 1000:.2f}ms, output error {relative_error(output, reference):.2%}, "
+            + ", ".join(f"{name} {'ok' if passed else 'FAILED'}" for name, passed in checks.items())
+        )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Speedup and fidelity of `step_cache.StepCache` at several thresholds and intervals.
+
+    python benchmarks/bench_step_cache.py                       # tiny random pipeline on CPU
+    python benchmarks/bench_step_cache.py --thresholds 0.05,0.1 --intervals 2 --size 512
+
+Runs the tiny FluxKontextPipeline once without the cache as reference, then once per
+adaptive threshold and per fixed interval with the same seed. Prints the steps and
+blocks skipped, the speedup and the PSNR of each output against the reference, to help
+pick STEP_CACHE_THRESHOLD. With random weights the residuals move differently from the
+trained model's, so rerun on the real pipeline (--real) before settling on a value.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from step_cache import StepCache  # noqa: E402
+
+PROMPT = "Relight the image, with sunshine from window. Add directional sunlight from window source. Maintain the identity of the foreground subjects."
+
+
+def psnr(a, b):
+    """Peak signal to noise ratio in dB of two float images in [0, 1]"""
+    mse = float(np.mean((a - b) ** 2))
+    return math.inf if mse == 0 else 10 * math.log10(1 / mse)
+
+
+@torch.no_grad()
+def relight(pipe, image, steps, seed):
+    width, height = image.size
+    start = time.perf_counter()
+    output = pipe(
+        image=image,
+        prompt=PROMPT,
+        num_inference_steps=steps,
+        guidance_scale=2.5,
+        width=width,
+        height=height,
+        max_area=width * height,
+        _auto_resize=False,
+        generator=torch.Generator().manual_seed(seed),
+        output_type="np",
+    ).images
+    return output, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--thresholds", default="0.02,0.05,0.1,0.2")
+    parser.add_argument("--intervals", default="2,3")
+    parser.add_argument("--steps", type=int, default=28)
+    parser.add_argument("--size", type=int, default=256, help="Image side in pixels")
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--single-layers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real", action="store_true", help="Use FLUX.1-Kontext-dev with the relighting LoRA")
+    args = parser.parse_args(argv)
+
+    if args.real:
+        import pipeline
+
+        pipe = pipeline.get_pipeline()
+    else:
+        from tiny import tiny_pipeline
+
+        pipe = tiny_pipeline(args.seed, num_layers=args.layers, num_single_layers=args.single_layers)
+    rng = np.random.default_rng(args.seed)
+    image = Image.fromarray(rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8))
+
+    relight(pipe, image, 2, args.seed)  # warm up
+    reference, reference_seconds = relight(pipe, image, args.steps, args.seed)
+    print(f"uncached: {reference_seconds:.3f}s")
+
+    configs = [(f"threshold {threshold}", StepCache(threshold=float(threshold))) for threshold in args.thresholds.split(",") if threshold]
+    configs += [(f"interval {interval}", StepCache(interval=int(interval))) for interval in args.intervals.split(",") if interval]
+    for name, cache in configs:
+        cache.attach(pipe.transformer)
+        try:
+            output, seconds = relight(pipe, image, args.steps, args.seed)
+        finally:
+            cache.detach()
+        stats = cache.stats()
+        print(
+            f"{name}: skipped {stats['skipped_steps']}/{stats['steps']} steps, {stats['skipped_blocks']} blocks, "
+            f"{seconds:.3f}s, speedup {reference_seconds / seconds:.2f}x, PSNR {psnr(output, reference):.2f}dB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Fused versus PEFT LoRA: output equivalence and transformer step time.
+
+    python benchmarks/lora_fusion.py            # tiny random transformer on CPU
+    python benchmarks/lora_fusion.py --layers 8 --size 64
+
+Attaches a random LoRA to a tiny FluxTransformer2DModel, runs it through PEFT, fuses it
+with `lora.FusedLora` at several strengths and checks every fused output matches the
+PEFT output at the same strength within `--atol`, and that the weights are bit for bit
+the same after switching away from a strength and back. Exits with status 1 on a mismatch.
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+from peft import LoraConfig
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lora import FusedLora  # noqa: E402
+from tiny import LORA_TARGET_MODULES, tiny_transformer, transformer_inputs  # noqa: E402
+
+
+@torch.no_grad()
+def step_seconds(transformer, inputs, repeats):
+    transformer(**inputs)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        transformer(**inputs)
+    return (time.perf_counter() - start) / repeats
+
+
+@torch.no_grad()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--size", type=int, default=16, help="Latent side in tokens")
+    parser.add_argument("--rank", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args(argv)
+
+    transformer = tiny_transformer(num_layers=args.layers, num_single_layers=args.layers)
+    inputs = transformer_inputs(transformer, height=args.size, width=args.size)
+    # init_lora_weights=False draws B at random too, so the adapter actually changes the output,
+    # and lora_alpha differs from the rank so a wrong scaling shows
+    transformer.add_adapter(
+        LoraConfig(r=args.rank, lora_alpha=2 * args.rank, target_modules=LORA_TARGET_MODULES, init_lora_weights=False),
+        adapter_name="lora",
+    )
+
+    # Ends on a weight other than the first strength, FusedLora must not pick it up from PEFT's scaling
+    strengths = [0.75, 1.0, 0.5, 0.75]
+    expected = {}
+    for strength in dict.fromkeys(strengths):
+        transformer.set_adapters(["lora"], weights=[strength])
+        expected[strength] = transformer(**inputs)[0]
+    unfused = step_seconds(transformer, inputs, args.repeats)
+
+    fused_lora = FusedLora(transformer, adapter_name="lora", strength=strengths[0])
+    first_weights = [base_layer.weight.clone() for base_layer, *_ in fused_lora.factors]
+    failures = 0
+    for strength in strengths:
+        fused_lora.set_strength(strength)
+        error = (transformer(**inputs)[0] - expected[strength]).abs().max().item()
+        status = "ok" if error <= args.atol else "MISMATCH"
+        failures += status != "ok"
+        print(f"strength {strength}: max abs error {error:.2e} {status}")
+    drifted = sum(not torch.equal(base_layer.weight, weight) for (base_layer, *_), weight in zip(fused_lora.factors, first_weights))
+    failures += drifted > 0
+    print(f"back at strength {strengths[-1]}: {drifted} of {len(first_weights)} weights drifted {'MISMATCH' if drifted else 'ok'}")
+    fused = step_seconds(transformer, inputs, args.repeats)
+
+    print(f"step: PEFT {unfused * 1000:.2f}ms, fused {fused * 1000:.2f}ms, speedup {unfused / fused:.2f}x")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Cost of the streamed previews compared with a denoising step.
+
+    python benchmarks/preview_decode.py --step-seconds 0.45
+
+Times the x0 extrapolation plus the latent-to-RGB projection and PIL conversion done by
+`preview.PreviewStreamer` on random FLUX-shaped latents for each resolution bucket, and
+prints it as a fraction of the given step time (read it from relight_denoise_step_seconds
+on /metrics). Runs on CUDA when available, otherwise on CPU.
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preview import PreviewStreamer  # noqa: E402
+from resolution import make_buckets  # noqa: E402
+
+
+def time_preview(width, height, batch_size, device, repeats):
+    tokens = (height // 16) * (width // 16)
+    previous = torch.randn(batch_size, tokens, 64, device=device, dtype=torch.bfloat16)
+    latents = torch.randn(batch_size, tokens, 64, device=device, dtype=torch.bfloat16)
+    pipe = SimpleNamespace(scheduler=SimpleNamespace(sigmas=torch.linspace(1, 0, 29)), vae_scale_factor=8)
+    requests = [SimpleNamespace(on_preview=lambda preview, step: None, preview_every=1) for _ in range(batch_size)]
+    streamer = PreviewStreamer(requests, height, width)
+
+    timings = []
+    for _ in range(repeats + 1):
+        streamer.previous = previous
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        streamer.on_step_end(pipe, 10, None, {"latents": latents})
+        timings.append(time.perf_counter() - start)
+    # The first call pays for kernel launches and allocations
+    return sorted(timings[1:])[len(timings[1:]) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--step-seconds", type=float, default=0.45, help="Denoising step time to compare against")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"device={device} batch_size={args.batch_size} step={args.step_seconds * 1000:.0f}ms")
+    for width, height in make_buckets()[::4]:
+        seconds = time_preview(width, height, args.batch_size, device, args.repeats)
+        print(f"{width}x{height}: {seconds * 1000:.2f}ms per preview, {seconds / args.step_seconds:.1%} of a step")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Latency, throughput and peak memory of the full relight request path.
+
+    python benchmarks/relight.py --backend stub --output stub.json
+    python benchmarks/relight.py --backend tiny --output after.json --compare before.json --threshold 0.1
+    MAX_MEGAPIXELS=0.0625 python benchmarks/relight.py --backend tiny --repeats 2 --cold-runs 3
+    python benchmarks/relight.py --backend real --resolutions 1024x1024,1568x672 --repeats 5
+
+Drives `app.infer` end to end (JPEG decode, conversion, resolution bucketing, prompt
+building, result cache, micro-batching scheduler, pipeline call, previews and output
+handling) over every combination of resolution, preset, direction and guidance scale.
+Inputs are synthetic JPEGs and seeds are fixed, so two runs issue the same requests.
+Each request uses its own seed, so the result cache always misses.
+
+Backends: `stub` (no model, measures everything around it), `tiny` (a randomly
+initialised FluxKontextPipeline with a few thousand parameters, runs on CPU) and `real`
+(FLUX.1-Kontext-dev with the relighting LoRA, needs a GPU). Inputs are bucketed under
+MAX_MEGAPIXELS like in the app: on a CPU, lower it for the tiny backend, whose steps
+take about a second at the default 1 megapixel.
+
+Cold latency is measured in --cold-runs fresh processes, each loading the backend,
+importing the app and sending the first request at every resolution, so it includes
+the shapes the pipeline has not run yet and nothing is cached in memory. Their
+percentiles are reported for the load, the first request per resolution and the time
+to the first result. Then, in this process, one request per resolution warms up the
+shapes and every following request is warm. With --compare, cold and warm latency
+percentiles, throughput and peak memory are checked against a previous JSON result,
+and the script exits with status 1 when any of them regressed by more than --threshold.
+
+With --sweep N, N preset variants of the first resolution are also relit once through
+`app.sweep` and once as N sequential `app.infer` calls, and both totals are reported.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Keep the benchmark's results away from the app's cache, app reads this at import
+os.environ.setdefault("RESULT_CACHE_DIR", tempfile.mkdtemp(prefix="relight-bench-"))
+
+import pipeline  # noqa: E402
+
+# (name, higher is better) of every value --compare checks
+COMPARED = [
+    ("cold.time_to_first_result.p50", False),
+    ("cold.first_request.all.p50", False),
+    ("cold.first_request.all.p90", False),
+    ("warm.all.p50", False),
+    ("warm.all.p90", False),
+    ("warm.all.p99", False),
+    ("throughput_images_per_second", True),
+    ("peak_cuda_memory_bytes", False),
+]
+
+
+def percentile(values, q):
+    """Linearly interpolated `q`-th percentile of `values`"""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "mean": sum(latencies) / len(latencies),
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def make_input(directory, width, height, seed):
+    """A JPEG with gradients and noise, so decode and encode do realistic work"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    pixels = np.clip(pixels + rng.normal(0, 12, pixels.shape), 0, 255).astype(np.uint8)
+    path = os.path.join(directory, f"input_{width}x{height}.jpg")
+    Image.fromarray(pixels).save(path, quality=90)
+    return path
+
+
+def load_backend(backend):
+    """Install the backend's pipeline and return the seconds it took to load"""
+    start = time.perf_counter()
+    if backend == "stub":
+        pipeline.set_pipeline(pipeline.StubPipeline())
+    elif backend == "tiny":
+        from tiny import tiny_pipeline
+
+        pipe = tiny_pipeline()
+        # One bar per request would drown the results
+        pipe.set_progress_bar_config(disable=True)
+        pipeline.set_pipeline(pipe)
+    pipeline.get_pipeline()
+    return time.perf_counter() - start
+
+
+def relight(app, path, preset, direction, guidance_scale, seed):
+    """Seconds taken by one request through `app.infer`, consuming the streamed previews like a client"""
+    start = time.perf_counter()
+    for _ in app.infer(path, "", preset, direction, seed=seed, guidance_scale=guidance_scale):
+        pass
+    return time.perf_counter() - start
+
+
+def cold_probe(args):
+    """One cold start in this process: load the backend, import the app, then the first request at every resolution"""
+    load_seconds = load_backend(args.backend)
+    start = time.perf_counter()
+    import app
+    import_seconds = time.perf_counter() - start
+    inputs_dir = tempfile.mkdtemp(prefix="relight-bench-inputs-")
+    first_request = {}
+    for width, height in parse_resolutions(args.resolutions):
+        path = make_input(inputs_dir, width, height, args.seed)
+        first_request[f"{width}x{height}"] = relight(app, path, args.presets.split("|")[0], args.directions.split(",")[0], float(args.guidance_scales.split(",")[0]), args.seed)
+    return {"load_seconds": load_seconds, "import_seconds": import_seconds, "first_request": first_request}
+
+
+def measure_cold(args):
+    """Percentiles of `cold_probe` over --cold-runs fresh processes"""
+    env = dict(os.environ)
+    # Each process gets its own empty result cache
+    env.pop("RESULT_CACHE_DIR", None)
+    runs = []
+    for run_index in range(args.cold_runs):
+        command = [
+            sys.executable, os.path.abspath(__file__), "--cold-probe",
+            "--backend", args.backend, "--resolutions", args.resolutions, "--presets", args.presets,
+            "--directions", args.directions, "--guidance-scales", args.guidance_scales, "--seed", str(args.seed + run_index),
+        ]
+        output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+        print(f"cold run {run_index + 1}: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in runs[-1]["first_request"].items()), flush=True)
+
+    first_request = {"all": summarize([seconds for run in runs for seconds in run["first_request"].values()])}
+    for name in runs[0]["first_request"]:
+        first_request[name] = summarize([run["first_request"][name] for run in runs])
+    return {
+        "runs": len(runs),
+        "load_seconds": summarize([run["load_seconds"] for run in runs]),
+        "import_seconds": summarize([run["import_seconds"] for run in runs]),
+        "first_request": first_request,
+        # From process start to the first image: load, import and the first request at the first resolution
+        "time_to_first_result": summarize([run["load_seconds"] + run["import_seconds"] + next(iter(run["first_request"].values())) for run in runs]),
+    }
+
+
+def parse_resolutions(resolutions):
+    return [tuple(int(side) for side in resolution.split("x")) for resolution in resolutions.split(",")]
+
+
+def time_sweep(app, path, presets, directions, guidance_scale, seed):
+    """Seconds for relighting every preset/direction pair with one `app.sweep` call, then with sequential `app.infer` calls"""
+    start = time.perf_counter()
+    for _ in app.sweep(path, presets, directions, seed=seed, guidance_scale=guidance_scale):
+        pass
+    sweep_seconds = time.perf_counter() - start
+    # A different seed, so the sequential calls miss the results cached by the sweep
+    start = time.perf_counter()
+    for preset, direction in itertools.product(presets, directions):
+        relight(app, path, preset, direction, guidance_scale, seed + 1)
+    return sweep_seconds, time.perf_counter() - start
+
+
+def run(args):
+    resolutions = parse_resolutions(args.resolutions)
+    presets = args.presets.split("|")
+    directions = args.directions.split(",")
+    guidance_scales = [float(scale) for scale in args.guidance_scales.split(",")]
+
+    cold = measure_cold(args) if args.cold_runs else None
+    if cold:
+        summary = cold["first_request"]["all"]
+        print(f"cold first request: p50 {summary['p50']:.3f}s p90 {summary['p90']:.3f}s ({cold['runs']} processes), "
+              f"time to first result p50 {cold['time_to_first_result']['p50']:.3f}s", flush=True)
+
+    torch.manual_seed(args.seed)
+    load_seconds = load_backend(args.backend)
+    start = time.perf_counter()
+    import app
+    import_seconds = time.perf_counter() - start
+
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    inputs_dir = tempfile.mkdtemp(prefix="relight-bench-inputs-")
+    inputs = {resolution: make_input(inputs_dir, *resolution, args.seed) for resolution in resolutions}
+    cells = list(itertools.product(resolutions, presets, directions, guidance_scales))
+    seeds = itertools.count(args.seed)
+
+    # Runs every resolution once so the warm requests don't pay for new shapes
+    warm_up = {}
+    for resolution in resolutions:
+        name = "{}x{}".format(*resolution)
+        warm_up[name] = relight(app, inputs[resolution], presets[0], directions[0], guidance_scales[0], next(seeds))
+        print(f"warm-up {name}: {warm_up[name]:.3f}s", flush=True)
+
+    jobs = [(cell, next(seeds)) for cell in cells for _ in range(args.repeats)]
+
+    def job(item):
+        (resolution, preset, direction, guidance_scale), seed = item
+        return "{}x{}".format(*resolution), relight(app, inputs[resolution], preset, direction, guidance_scale, seed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        results = list(executor.map(job, jobs))
+    wall = time.perf_counter() - start
+
+    warm = {"all": summarize([seconds for _, seconds in results])}
+    for resolution in dict.fromkeys(name for name, _ in results):
+        warm[resolution] = summarize([seconds for name, seconds in results if name == resolution])
+    for name, summary in warm.items():
+        print(f"warm {name}: p50 {summary['p50']:.3f}s p90 {summary['p90']:.3f}s p99 {summary['p99']:.3f}s ({summary['count']} requests)")
+
+    result = {
+        "backend": args.backend,
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "device": torch.cuda.get_device_name() if torch.cuda.is_available() else platform.processor() or "cpu",
+        },
+        "load_seconds": load_seconds,
+        "import_seconds": import_seconds,
+        "cold": cold,
+        "warm_up": warm_up,
+        "warm": warm,
+        "throughput_images_per_second": len(results) / wall,
+        "peak_cuda_memory_bytes": torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+    print(f"throughput: {result['throughput_images_per_second']:.3f} images/s at concurrency {args.concurrency}")
+
+    if args.sweep:
+        from prompts import ILLUMINATION_OPTIONS
+
+        sweep_presets = list(ILLUMINATION_OPTIONS)[:args.sweep]
+        sweep_seconds, sequential_seconds = time_sweep(app, inputs[resolutions[0]], sweep_presets, ["auto"], guidance_scales[0], next(seeds))
+        result["sweep"] = {"variants": args.sweep, "sweep_seconds": sweep_seconds, "sequential_seconds": sequential_seconds}
+        print(f"sweep of {args.sweep}: {sweep_seconds:.3f}s, sequential {sequential_seconds:.3f}s, speedup {sequential_seconds / sweep_seconds:.2f}x")
+    return result
+
+
+def lookup(result, path):
+    for key in path.split("."):
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(baseline, current, threshold):
+    """Print the compared values side by side, and return the names of those that regressed"""
+    regressions = []
+    for path, higher_is_better in COMPARED:
+        before, after = lookup(baseline, path), lookup(current, path)
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        regressed = -change > threshold if higher_is_better else change > threshold
+        print(f"{path}: {before:.4g} -> {after:.4g} ({change:+.1%}){' REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(path)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["stub", "tiny", "real"], default="stub")
+    parser.add_argument("--resolutions", default="1024x1024,1568x672,768x1344", help="Comma separated input sizes")
+    parser.add_argument("--presets", default="sunshine from window|neon night, city|cozy candlelight", help="'|' separated illumination presets")
+    parser.add_argument("--directions", default="auto,left side")
+    parser.add_argument("--guidance-scales", default="2.5")
+    parser.add_argument("--repeats", type=int, default=3, help="Warm requests per matrix cell")
+    parser.add_argument("--cold-runs", type=int, default=5, help="Fresh processes measuring cold latency, 0 skips them")
+    parser.add_argument("--cold-probe", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--concurrency", type=int, default=1, help="Clients sending requests at the same time")
+    parser.add_argument("--sweep", type=int, default=0, help="Also compare a sweep of this many presets with sequential calls")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Previous JSON result to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    if args.cold_probe:
+        # Read by measure_cold in the parent process, as the last line of the output
+        print(json.dumps(cold_probe(args)))
+        return 0
+    result = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("backend") != result["backend"]:
+            print(f"warning: comparing a {result['backend']} run against a {baseline.get('backend')} baseline")
+        if compare(baseline, result, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Tiny randomly initialised FLUX components for benchmarks and checks on a CPU-only box."""
+import hashlib
+
+import torch
+from diffusers import AutoencoderKL, FlowMatchEulerDiscreteScheduler, FluxKontextPipeline, FluxTransformer2DModel
+from peft import LoraConfig
+
+# Linear layers the relighting LoRA adapts in the FLUX transformer
+LORA_TARGET_MODULES = ["to_q", "to_k", "to_v", "to_out.0", "add_q_proj", "add_k_proj", "add_v_proj", "to_add_out", "proj_mlp", "proj_out"]
+
+
+def tiny_transformer(seed=0, num_layers=2, num_single_layers=2, attention_head_dim=16, num_attention_heads=2):
+    """A FluxTransformer2DModel with the layout of FLUX.1 and a few thousand parameters"""
+    torch.manual_seed(seed)
+    return FluxTransformer2DModel(
+        patch_size=1,
+        in_channels=4,
+        num_layers=num_layers,
+        num_single_layers=num_single_layers,
+        attention_head_dim=attention_head_dim,
+        num_attention_heads=num_attention_heads,
+        joint_attention_dim=32,
+        pooled_projection_dim=32,
+        # The rotary embedding splits each head between the (text, row, column) position axes
+        axes_dims_rope=[attention_head_dim // 4, attention_head_dim // 4, attention_head_dim // 2],
+    ).eval()
+
+
+def transformer_inputs(transformer, batch_size=1, height=16, width=16, text_tokens=8, seed=0):
+    """Random keyword arguments for one forward of `transformer` on packed latents"""
+    generator = torch.Generator().manual_seed(seed)
+    config = transformer.config
+    image_ids = torch.zeros(height, width, 3)
+    image_ids[..., 1] = torch.arange(height)[:, None]
+    image_ids[..., 2] = torch.arange(width)[None, :]
+    return {
+        "hidden_states": torch.randn(batch_size, height * width, config.in_channels, generator=generator),
+        "encoder_hidden_states": torch.randn(batch_size, text_tokens, config.joint_attention_dim, generator=generator),
+        "pooled_projections": torch.randn(batch_size, config.pooled_projection_dim, generator=generator),
+        "timestep": torch.full((batch_size,), 0.5),
+        "img_ids": image_ids.reshape(-1, 3),
+        "txt_ids": torch.zeros(text_tokens, 3),
+        "return_dict": False,
+    }
+
+
+class TinyKontextPipeline(FluxKontextPipeline):
+    """
+    FluxKontextPipeline without text encoders: prompts are embedded by seeding random
+    tensors with their hash, so the same prompt always gets the same embedding and
+    nothing is downloaded.
+    """
+
+    def encode_prompt(self, prompt, prompt_2=None, device=None, num_images_per_prompt=1, prompt_embeds=None, pooled_prompt_embeds=None, max_sequence_length=512, lora_scale=None):
+        device = device or self._execution_device
+        config = self.transformer.config
+        if prompt_embeds is None:
+            prompts = [prompt] if isinstance(prompt, str) else prompt
+            generators = [torch.Generator().manual_seed(int(hashlib.sha256(text.encode()).hexdigest()[:8], 16)) for text in prompts]
+            prompt_embeds = torch.stack([torch.randn(8, config.joint_attention_dim, generator=generator) for generator in generators]).to(device)
+            pooled_prompt_embeds = torch.stack([torch.randn(config.pooled_projection_dim, generator=generator) for generator in generators]).to(device)
+        text_ids = torch.zeros(prompt_embeds.shape[1], 3, device=device, dtype=prompt_embeds.dtype)
+        return prompt_embeds, pooled_prompt_embeds, text_ids
+
+
+def tiny_pipeline(seed=0, num_layers=2, num_single_layers=2, lora_rank=4):
+    """
+    A `TinyKontextPipeline` with a random LoRA attached as adapter "lora".
+
+    The VAE downsamples by 8 like the real one, so every resolution bucket gives the
+    same number of tokens as FLUX.1-Kontext, only through much narrower layers.
+    """
+    transformer = tiny_transformer(seed, num_layers=num_layers, num_single_layers=num_single_layers)
+    transformer.add_adapter(LoraConfig(r=lora_rank, lora_alpha=lora_rank, target_modules=LORA_TARGET_MODULES), adapter_name="lora")
+    torch.manual_seed(seed)
+    vae = AutoencoderKL(
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        block_out_channels=(4, 4, 4, 4),
+        layers_per_block=1,
+        latent_channels=1,
+        norm_num_groups=1,
+        use_quant_conv=False,
+        use_post_quant_conv=False,
+        shift_factor=0.0609,
+        scaling_factor=1.5035,
+    ).eval()
+    scheduler = FlowMatchEulerDiscreteScheduler(shift=3.0, use_dynamic_shifting=True, base_shift=0.5, max_shift=1.15)
+    return TinyKontextPipeline(
+        scheduler=scheduler,
+        vae=vae,
+        text_encoder=None,
+        tokenizer=None,
+        text_encoder_2=None,
+        tokenizer_2=None,
+        transformer=transformer,
+    )
@@ -0,0 +1,151 @@
+import io
+import os
+import threading
+import warnings
+from collections import deque
+
+import numpy as np
+import torch
+from PIL import Image, ImageOps
+
+# EXIF orientation tag, and the orientations that swap width and height
+ORIENTATION = 0x0112
+TRANSPOSING_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def upright_size(image):
+    """Size of `image` once turned upright according to its EXIF orientation"""
+    width, height = image.size
+    if image.getexif().get(ORIENTATION, 1) in TRANSPOSING_ORIENTATIONS:
+        return height, width
+    return width, height
+
+
+def open_image(source, fit=None):
+    """
+    Decode an image from a path, a file object or a PIL image, upright according to its EXIF orientation.
+
+    `fit` maps the upright size to the smallest size needed downstream (e.g.
+    `ResolutionPolicy.bucket_for`): JPEGs are then decoded straight at the smallest DCT
+    scale that still covers it, which is several times faster for large photos. The
+    result is then smaller than the upload, take `upright_size` first to keep its size.
+    """
+    image = source if isinstance(source, Image.Image) else Image.open(source)
+    orientation = image.getexif().get(ORIENTATION, 1)
+    if fit is not None:
+        target_width, target_height = fit(upright_size(image))
+        if orientation in TRANSPOSING_ORIENTATIONS:
+            target_width, target_height = target_height, target_width
+        image.draft(image.mode, (target_width, target_height))
+    if orientation != 1:
+        return ImageOps.exif_transpose(image)
+    image.load()
+    return image
+
+
+def to_rgb(image, background=(255, 255, 255)):
+    """`image` in RGB, as is when it already is, with any transparency flattened onto `background`"""
+    if image.mode == "RGB":
+        return image
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        flattened = Image.new("RGB", image.size, background)
+        flattened.paste(rgba, mask=rgba.getchannel("A"))
+        return flattened
+    return image.convert("RGB")
+
+
+def downscale(image, max_side):
+    """`image` shrunk so its longest side is at most `max_side`, as is when it already fits"""
+    if max(image.size) <= max_side:
+        return image
+    scale = max_side / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def to_tensor(images, device, dtype):
+    """
+    Stack RGB images into a `(batch, 3, height, width)` tensor in [0, 1] on `device`.
+
+    Pixels leave PIL once, cross to the device as uint8, a quarter of the float32 bytes,
+    and are only converted to `dtype` there.
+    """
+    arrays = [np.asarray(image) for image in images]
+    array = arrays[0][None] if len(arrays) == 1 else np.stack(arrays)
+    with warnings.catch_warnings():
+        # The array may be a read-only view of PIL's buffer, the tensor is only read from
+        warnings.simplefilter("ignore", UserWarning)
+        pixels = torch.from_numpy(array)
+    return pixels.to(device, non_blocking=True).permute(0, 3, 1, 2).to(dtype) / 255
+
+
+def to_images(pixels):
+    """PIL images from a `(batch, 3, height, width)` tensor in [0, 1], quantized to uint8 before leaving the device"""
+    array = pixels.mul(255).round_().clamp_(0, 255).to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+    return [Image.fromarray(sample) for sample in array]
+
+
+class OutputEncoder:
+    """
+    Encodes response images to files Gradio serves as they are, instead of its default encoding.
+
+    JPEG and WebP at a chosen quality are several times smaller than PNG for photos. JPEG
+    encodes a megapixel in about 5 ms, WebP is about 30% smaller but takes 40 ms even at its
+    fastest method and 150 ms at Pillow's default one. Only the last `max_files` files are
+    kept: Gradio copies each file into its own cache when the response is sent, so older
+    ones are no longer needed.
+
+    Args:
+        directory (str): Where the encoded files are written.
+        format (str): "jpeg", "webp" or "png".
+        quality (int): Quality of the lossy formats, 1 to 100.
+        max_files (int): Number of files kept in `directory`.
+    """
+
+    EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+    # libwebp's fastest method, the default 4 is about 4x slower for a few percent smaller files
+    WEBP_METHOD = 0
+
+    def __init__(self, directory, format="jpeg", quality=90, max_files=512):
+        if format not in self.EXTENSIONS:
+            raise ValueError(f"format must be one of {', '.join(self.EXTENSIONS)}, got {format!r}")
+        self.directory = directory
+        self.format = format
+        self.quality = quality
+        self.max_files = max_files
+        self.files = deque()
+        self.count = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def to_bytes(self, image):
+        """`image` encoded in the output format"""
+        buffer = io.BytesIO()
+        if self.format == "png":
+            image.save(buffer, format="png")
+        elif self.format == "webp":
+            image.save(buffer, format="webp", quality=self.quality, method=self.WEBP_METHOD)
+        else:
+            image.save(buffer, format=self.format, quality=self.quality)
+        return buffer.getvalue()
+
+    def write(self, data):
+        """Write bytes encoded by `to_bytes`, e.g. from the result cache, and return `(path, size_in_bytes)`"""
+        with self._lock:
+            self.count += 1
+            path = os.path.join(self.directory, f"{os.getpid()}-{self.count}{self.EXTENSIONS[self.format]}")
+            self.files.append(path)
+            expired = [self.files.popleft() for _ in range(len(self.files) - self.max_files)]
+        for old in expired:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+        with open(path, "wb") as f:
+            f.write(data)
+        return path, len(data)
+
+    def encode(self, image):
+        """Write `image` and return `(path, size_in_bytes)`"""
+        return self.write(self.to_bytes(image))
@@ -0,0 +1,171 @@
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from scheduler import BULK, INTERACTIVE
+
+PRIORITIES = {"interactive": INTERACTIVE, "bulk": BULK}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFull(Exception):
+    """Raised by `JobManager.submit` when the queue is at capacity"""
+
+
+class Job:
+    """A unit of work submitted to a `JobManager`, polled by the client through its id"""
+
+    def __init__(self, fn, args, kwargs, priority):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.state = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        # Set on cancellation, the job function is expected to watch it
+        self.cancelled = threading.Event()
+        # Stage timings reported by the job function, if any
+        self.stages = {}
+        self.submitted_at = time.time()
+        self._submitted = time.perf_counter()
+        self._started = None
+        self._finished = None
+
+    def set_progress(self, done, total):
+        self.progress = done / total if total else 0.0
+
+    def status(self):
+        now = time.perf_counter()
+        started = self._started or now
+        return {
+            "id": self.id,
+            "state": self.state,
+            "priority": "interactive" if self.priority == INTERACTIVE else "bulk",
+            "progress": 1.0 if self.state == DONE else round(self.progress, 4),
+            "submitted_at": self.submitted_at,
+            "queue_seconds": round(started - self._submitted, 4),
+            "run_seconds": round((self._finished or now) - started, 4) if self._started else 0.0,
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Bounded in-process job queue with priority classes, for clients that poll instead of
+    holding a connection open.
+
+    Jobs are taken by priority class first, then in submission order, by a fixed pool of
+    worker threads. Admission control caps the number of queued and running jobs, and
+    finished jobs are kept for polling up to `max_finished`, the oldest being forgotten
+    first, so a burst cannot grow memory without limit.
+
+    Args:
+        workers (int): Jobs running at the same time. They mostly wait on the GPU
+            scheduler, so this should be at least its batch size for jobs to be batched.
+        max_queued (int): Queued plus running jobs above which `submit` raises `QueueFull`.
+        max_finished (int): Finished jobs kept for polling.
+        on_evict (callable): Called with a finished job when it is forgotten, e.g. to
+            delete its result file.
+    """
+
+    def __init__(self, workers=4, max_queued=32, max_finished=256, on_evict=None):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self.on_evict = on_evict
+        self.jobs = {}
+        self.finished = OrderedDict()
+        self.active = 0
+        self.rejected = 0
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, priority=BULK, **kwargs):
+        """Queue `fn(job, *args, **kwargs)` and return its `Job`, or raise `QueueFull`"""
+        with self._lock:
+            if self.active >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(f"{self.active} jobs are already queued or running")
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._loop, name=f"relight-jobs-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            job = Job(fn, args, kwargs, priority)
+            self.jobs[job.id] = job
+            self.active += 1
+        self._queue.put((priority, next(self._order), job))
+        return job
+
+    def get(self, job_id):
+        """The job with id `job_id`, raises KeyError for unknown or forgotten jobs"""
+        with self._lock:
+            return self.jobs[job_id]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job, returns False if it already finished"""
+        job = self.get(job_id)
+        with self._lock:
+            if job.state in (DONE, FAILED, CANCELLED):
+                return False
+            job.cancelled.set()
+            if job.state == QUEUED:
+                # The worker skips it when it comes up
+                self._finish(job, CANCELLED)
+        return True
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self.jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {"active": self.active, "rejected": self.rejected, **states}
+
+    def _finish(self, job, state):
+        # Called with the lock held
+        job.state = state
+        job._finished = time.perf_counter()
+        job.fn = job.args = job.kwargs = None
+        self.active -= 1
+        self.finished[job.id] = job
+        while len(self.finished) > self.max_finished:
+            _, evicted = self.finished.popitem(last=False)
+            del self.jobs[evicted.id]
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def _loop(self):
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                if job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job._started = time.perf_counter()
+            try:
+                result = job.fn(job, *job.args, **job.kwargs)
+            except Exception as e:
+                with self._lock:
+                    if job.cancelled.is_set():
+                        self._finish(job, CANCELLED)
+                    else:
+                        job.error = f"{type(e).__name__}: {e}"
+                        self._finish(job, FAILED)
+            else:
+                with self._lock:
+                    job.result = result
+                    self._finish(job, CANCELLED if job.cancelled.is_set() else DONE)
@@ -0,0 +1,114 @@
+import math
+import threading
+from collections import OrderedDict
+
+import torch
+from peft.tuners.lora import LoraLayer
+
+
+def _base_scaling(model, module, adapter_name):
+    """Scaling of an adapter at weight 1, whatever weight `set_adapters` last gave it"""
+    rank, alpha = module.r[adapter_name], module.lora_alpha[adapter_name]
+    use_rslora = getattr(module, "use_rslora", None)
+    if isinstance(use_rslora, dict):
+        use_rslora = use_rslora.get(adapter_name, False)
+    elif use_rslora is None:
+        config = getattr(model, "peft_config", {}).get(adapter_name)
+        use_rslora = getattr(config, "use_rslora", False)
+    return alpha / math.sqrt(rank) if use_rslora else alpha / rank
+
+
+def _add_delta(weight, lora_a, lora_b, alpha):
+    """`weight += alpha * B @ A` in place, in the weight's dtype without a dense float32 temporary"""
+    weight.addmm_(lora_b.to(weight.device, weight.dtype), lora_a.to(weight.device, weight.dtype), alpha=alpha)
+
+
+class FusedLora:
+    """
+    Fuses a PEFT LoRA adapter into the base weights of a model and switches its strength in place.
+
+    With PEFT every adapted linear layer runs two extra matmuls on every forward. Fusing
+    adds `strength * scaling * B @ A` to the base weight once, so denoising steps cost the
+    same as without a LoRA. `scaling` is `lora_alpha / r` (`/ sqrt(r)` with rsLoRA), not
+    PEFT's `scaling`, which already has any `set_adapters` weight multiplied in.
+
+    Only the low-rank factors are kept, on the weights' device, they are tiny next to the
+    transformer. Switching from `s` to `t` unfuses `s` by subtracting its delta and fuses
+    `t` by adding its own, in place, so any strength is a few matmuls away instead of a
+    reload from safetensors.
+
+    Subtracting a delta rounds differently than adding it did for a few percent of the
+    weights, so each fused strength also keeps, on the CPU, the indices and original
+    values of the weights its unfusing would not restore exactly. Unfusing puts them back
+    and the base weights never drift, however often the strength changes. These
+    corrections are kept for the `cache_size` most recently used strengths, switching
+    back to one of them skips recomputing them.
+
+    The PEFT layers are removed from the model once fused.
+
+    Args:
+        model (torch.nn.Module): Model with a PEFT adapter loaded, e.g. `pipe.transformer`.
+        adapter_name (str): Name of the adapter to fuse.
+        strength (float): Initial strength, the equivalent of the `set_adapters` weight.
+        cache_size (int): Number of strengths whose corrections are kept.
+    """
+
+    def __init__(self, model, adapter_name="lora", strength=1.0, cache_size=4):
+        self.factors = []
+        for module in model.modules():
+            if isinstance(module, LoraLayer) and adapter_name in module.lora_A:
+                self.factors.append((
+                    module.get_base_layer(),
+                    module.lora_A[adapter_name].weight.detach().clone(),
+                    module.lora_B[adapter_name].weight.detach().clone(),
+                    _base_scaling(model, module, adapter_name),
+                ))
+        if not self.factors:
+            raise ValueError(f"No LoRA layers named {adapter_name!r} found in {type(model).__name__}")
+        model.unload_lora()
+        self.strength = 0.0
+        self.cache_size = cache_size
+        # Strength -> per layer `(indices, values)` of the base weights its unfusing gets wrong, least recently used first
+        self.corrections = OrderedDict()
+        self._lock = threading.Lock()
+        self.set_strength(strength)
+
+    @torch.no_grad()
+    def _unfuse(self):
+        for (base_layer, lora_a, lora_b, scaling), (indices, values) in zip(self.factors, self.corrections[self.strength]):
+            weight = base_layer.weight
+            _add_delta(weight, lora_a, lora_b, -scaling * self.strength)
+            weight.view(-1)[indices.to(weight.device, torch.long)] = values.to(weight.device)
+
+    @torch.no_grad()
+    def _fuse(self, strength):
+        if strength in self.corrections:
+            for base_layer, lora_a, lora_b, scaling in self.factors:
+                _add_delta(base_layer.weight, lora_a, lora_b, scaling * strength)
+            self.corrections.move_to_end(strength)
+            return
+        corrections = []
+        for base_layer, lora_a, lora_b, scaling in self.factors:
+            weight = base_layer.weight
+            base = weight.detach().clone()
+            _add_delta(weight, lora_a, lora_b, scaling * strength)
+            # Unfuse a copy exactly like `_unfuse` will, and remember what it doesn't restore
+            unfused = weight.detach().clone()
+            _add_delta(unfused, lora_a, lora_b, -scaling * strength)
+            indices = (unfused != base).view(-1).nonzero().squeeze(1)
+            corrections.append((indices.to("cpu", torch.int32), base.view(-1)[indices].cpu()))
+        self.corrections[strength] = corrections
+        while len(self.corrections) > max(self.cache_size, 1):
+            self.corrections.popitem(last=False)
+
+    def set_strength(self, strength):
+        """Re-fuse the adapter at `strength`, a no-op if it is already fused at that strength"""
+        with self._lock:
+            if strength == self.strength:
+                return
+            if self.strength:
+                self._unfuse()
+            self.strength = 0.0
+            if strength:
+                self._fuse(strength)
+            self.strength = strength
@@ -0,0 +1,149 @@
+from dataclasses import dataclass
+
+GB = 1024**3
+
+# Execution modes from the fastest and hungriest to the slowest and leanest
+PLAIN = "plain"
+VAE_TILING = "vae_tiling"
+MODEL_OFFLOAD = "model_offload"
+SEQUENTIAL_OFFLOAD = "sequential_offload"
+MODES = (PLAIN, VAE_TILING, MODEL_OFFLOAD, SEQUENTIAL_OFFLOAD)
+OFFLOAD_MODES = (MODEL_OFFLOAD, SEQUENTIAL_OFFLOAD)
+
+# Rough bfloat16 footprints of FLUX.1-Kontext-dev, measured with torch.cuda.max_memory_allocated
+TRANSFORMER_BYTES = 23.8 * GB
+TEXT_ENCODER_BYTES = 9.8 * GB
+VAE_BYTES = 0.2 * GB
+# Transformer activations per token per sample, and full VAE decode activations per pixel per sample
+TRANSFORMER_BYTES_PER_TOKEN = 240 * 1024
+VAE_BYTES_PER_PIXEL = 4 * 1024
+# A tiled VAE decodes 512x512 tiles one sample at a time, whatever the resolution and batch
+VAE_TILE_BYTES = VAE_BYTES_PER_PIXEL * 512 * 512
+# What stays on the GPU under sequential offload: the largest single transformer block
+SEQUENTIAL_RESIDENT_BYTES = 0.6 * GB
+
+
+def cuda_memory():
+    """`(free, total)` bytes of the current CUDA device, or None without CUDA"""
+    import torch
+
+    if not torch.cuda.is_available():
+        return None
+    return torch.cuda.mem_get_info()
+
+
+@dataclass
+class ExecutionPlan:
+    mode: str
+    batch_size: int
+    estimated_bytes: int
+
+
+class MemoryPlanner:
+    """
+    Picks the fastest execution mode whose estimated peak memory fits a budget.
+
+    Modes are tried in order: plain, tiled/sliced VAE, then model and sequential CPU
+    offload. Within the GPU-resident modes the batch is sliced into smaller sub-batches
+    before giving up on a mode. The FLUX transformer runs attention through
+    `scaled_dot_product_attention` and has no attention slicing hook, so batch slicing is
+    what bounds its activations here.
+
+    Args:
+        budget_bytes (int): Memory budget, defaults to the device total reported by
+            `memory_reporter`.
+        memory_reporter (callable): Returns `(free, total)` bytes, or None when there is
+            no accelerator (every request is then planned as plain).
+        text_encoders_resident (bool): Whether the text encoders stay on the GPU.
+        weight_ratio (float): Size of the transformer and text encoder weights relative to
+            bfloat16, below 1 when they are quantized.
+        headroom (float): Fraction of the budget the estimate may use, to absorb
+            fragmentation and estimation error.
+    """
+
+    def __init__(self, budget_bytes=None, memory_reporter=cuda_memory, text_encoders_resident=True, weight_ratio=1.0, headroom=0.9):
+        self.budget_bytes = budget_bytes
+        self.memory_reporter = memory_reporter
+        self.text_encoders_resident = text_encoders_resident
+        self.weight_ratio = weight_ratio
+        self.headroom = headroom
+
+    def budget(self):
+        if self.budget_bytes:
+            return self.budget_bytes
+        memory = self.memory_reporter()
+        return memory[1] if memory else None
+
+    def weight_bytes(self, text_encoders=None):
+        """Bytes of the weights the GPU-resident modes keep on the device, with the text encoders if they stay there"""
+        if text_encoders is None:
+            text_encoders = self.text_encoders_resident
+        weights = TRANSFORMER_BYTES * self.weight_ratio + VAE_BYTES
+        if text_encoders:
+            weights += TEXT_ENCODER_BYTES * self.weight_ratio
+        return weights
+
+    def fits_on_device(self):
+        """Whether the whole pipeline, text encoders included, can be loaded on the device"""
+        budget = self.budget()
+        return budget is None or self.weight_bytes(text_encoders=True) <= budget * self.headroom
+
+    def estimate(self, mode, width, height, batch_size):
+        """Estimated peak bytes of one pipeline call"""
+        # Output latents plus the conditioning image latents, 16x16 pixels per token, and 512 text tokens
+        tokens = 2 * (width // 16) * (height // 16) + 512
+        activations = batch_size * tokens * TRANSFORMER_BYTES_PER_TOKEN
+        vae = batch_size * width * height * VAE_BYTES_PER_PIXEL if mode == PLAIN else VAE_TILE_BYTES
+        transformer = TRANSFORMER_BYTES * self.weight_ratio
+
+        if mode in (PLAIN, VAE_TILING):
+            return int(self.weight_bytes() + max(activations, vae))
+        if mode == MODEL_OFFLOAD:
+            # Components are moved to the GPU one at a time, the transformer is the largest
+            return int(transformer + max(activations, vae))
+        return int(SEQUENTIAL_RESIDENT_BYTES + max(activations, vae))
+
+    def plan(self, width, height, batch_size):
+        budget = self.budget()
+        if budget is None:
+            return ExecutionPlan(PLAIN, batch_size, 0)
+        limit = budget * self.headroom
+        for mode in MODES:
+            size = batch_size
+            while size >= 1:
+                estimated = self.estimate(mode, width, height, size)
+                if estimated <= limit:
+                    return ExecutionPlan(mode, size, estimated)
+                size //= 2
+        # Nothing fits, run the leanest mode and let the allocator have the last word
+        return ExecutionPlan(SEQUENTIAL_OFFLOAD, 1, self.estimate(SEQUENTIAL_OFFLOAD, width, height, 1))
+
+
+def apply_plan(pipe, mode, device="cuda", cpu_components=()):
+    """
+    Switch `pipe` to `mode`, undoing whatever the previous mode set up.
+
+    `cpu_components` name the modules left on the CPU in the GPU-resident modes, e.g.
+    offloaded text encoders.
+    """
+    current = getattr(pipe, "_execution_mode", PLAIN)
+    if mode == current:
+        return
+    if current in OFFLOAD_MODES:
+        pipe.remove_all_hooks()
+        # Going from one offload mode to the other, the whole pipeline may not fit on the device
+        if mode not in OFFLOAD_MODES:
+            for name, component in pipe.components.items():
+                if name not in cpu_components and hasattr(component, "to"):
+                    component.to(device)
+    if mode == PLAIN:
+        pipe.vae.disable_tiling()
+        pipe.vae.disable_slicing()
+    else:
+        pipe.vae.enable_tiling()
+        pipe.vae.enable_slicing()
+    if mode == MODEL_OFFLOAD:
+        pipe.enable_model_cpu_offload()
+    elif mode == SEQUENTIAL_OFFLOAD:
+        pipe.enable_sequential_cpu_offload()
+    pipe._execution_mode = mode
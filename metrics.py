@@ -0,0 +1,184 @@
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Set METRICS=0 to turn every trace into a no-op
+ENABLED = os.environ.get("METRICS", "1") == "1"
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STEP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5)
+BYTES_BUCKETS = tuple(2**power * 1024 for power in range(4, 14))
+
+logger = logging.getLogger("relight.metrics")
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus sense, one series per label value"""
+
+    def __init__(self, name, help, buckets, label=None):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        self.series = {}
+
+    def observe(self, value, label_value=None):
+        counts, totals = self.series.setdefault(label_value, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, (total, count)) in sorted(self.series.items(), key=lambda item: str(item[0])):
+            labels = f'{self.label}="{label_value}"' if self.label else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels + "," if labels else ""}le="{le}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.stages = Histogram("relight_stage_seconds", "Time spent in each stage of a relight request", STAGE_BUCKETS, "stage")
+        self.steps = Histogram("relight_denoise_step_seconds", "Time of a single denoising step", STEP_BUCKETS)
+        self.requests = Histogram("relight_request_seconds", "End to end time of a relight request", STAGE_BUCKETS)
+        self.response_bytes = Histogram("relight_response_bytes", "Encoded image bytes sent back per request", BYTES_BUCKETS)
+        self.cpu = Histogram("relight_request_cpu_seconds", "CPU time spent decoding, converting and encoding per request", STAGE_BUCKETS)
+        self.peak_memory = 0
+        self.execution_modes = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def add_collector(self, collect):
+        """Register a callable returning `{metric_name: value}` gauges, scraped on every render"""
+        self.collectors.append(collect)
+
+    def record(self, trace):
+        with self._lock:
+            for stage, seconds in trace.stages.items():
+                self.stages.observe(seconds, stage)
+            for seconds in trace.steps:
+                self.steps.observe(seconds)
+            self.requests.observe(trace.total)
+            if "response_bytes" in trace.fields:
+                self.response_bytes.observe(trace.fields["response_bytes"])
+            if "cpu_seconds" in trace.fields:
+                self.cpu.observe(trace.fields["cpu_seconds"])
+            self.peak_memory = max(self.peak_memory, trace.fields.get("peak_cuda_memory_bytes") or 0)
+            mode = trace.fields.get("execution_mode")
+            if mode:
+                self.execution_modes[mode] = self.execution_modes.get(mode, 0) + 1
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = self.stages.render() + self.steps.render() + self.requests.render() + self.response_bytes.render() + self.cpu.render()
+            lines += [
+                "# TYPE relight_peak_cuda_memory_bytes gauge",
+                f"relight_peak_cuda_memory_bytes {self.peak_memory}",
+                "# TYPE relight_execution_mode_total counter",
+            ]
+            lines += [f'relight_execution_mode_total{{mode="{mode}"}} {count}' for mode, count in self.execution_modes.items()]
+        for collect in self.collectors:
+            for name, value in collect().items():
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Trace:
+    """
+    Timings of a single relight request.
+
+    Stages are timed with `stage()` or added directly with `add()` when they are measured
+    elsewhere (e.g. once for a whole batch). `finish()` exports the trace to the registry
+    histograms and writes it as one JSON log line.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.steps = []
+        self.fields = {}
+        self.total = 0.0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def step(self, seconds):
+        self.steps.append(seconds)
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def merge(self, other):
+        """Add the stages, steps and fields `other` recorded, e.g. the copy of this trace timed in a GPU worker"""
+        for name, seconds in other.stages.items():
+            self.add(name, seconds)
+        self.steps += other.steps
+        self.fields.update(other.fields)
+
+    def finish(self, **fields):
+        self.fields.update(fields)
+        self.total = time.perf_counter() - self.start
+        REGISTRY.record(self)
+        logger.info(json.dumps({
+            "total": round(self.total, 4),
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+            "steps": len(self.steps),
+            "step_mean": round(sum(self.steps) / len(self.steps), 4) if self.steps else None,
+            **self.fields,
+        }))
+
+
+class NullTrace:
+    """Trace used when metrics are disabled, every method is a no-op"""
+
+    _context = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def add(self, name, seconds):
+        pass
+
+    def step(self, seconds):
+        pass
+
+    def set(self, **fields):
+        pass
+
+    def merge(self, other):
+        pass
+
+    def finish(self, **fields):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+def trace():
+    """A new `Trace`, or the shared `NullTrace` when metrics are disabled"""
+    return Trace() if ENABLED else NULL_TRACE
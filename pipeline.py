@@ -0,0 +1,571 @@
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from types import SimpleNamespace
+
+import torch
+from PIL import Image
+from diffusers import FluxKontextPipeline, FluxTransformer2DModel
+
+import metrics
+from image_io import to_images, to_tensor
+from lora import FusedLora
+from memory_planner import GB, MODEL_OFFLOAD, OFFLOAD_MODES, SEQUENTIAL_OFFLOAD, MemoryPlanner, apply_plan
+from preview import PreviewStreamer
+from prompt_cache import PromptEmbeddingCache
+from prompts import preset_prompts
+from quantization import MODES, WEIGHT_RATIO, load_quantized, model_bytes
+from step_cache import StepCache
+
+MODEL_ID = "black-forest-labs/FLUX.1-Kontext-dev"
+LORA_ID = "kontext-community/relighting-kontext-dev-lora-v3"
+LORA_WEIGHT_NAME = "relighting-kontext-dev-lora-v3.safetensors"
+LORA_WEIGHT = 0.75
+
+# Where the preset prompt embeddings are persisted between restarts
+PROMPT_EMBEDS_PATH = os.environ.get("PROMPT_EMBEDS_PATH", "prompt_embeds.pt")
+# Move the text encoders off the GPU once the presets are cached, custom prompts bring them back on demand
+OFFLOAD_TEXT_ENCODERS = os.environ.get("OFFLOAD_TEXT_ENCODERS", "0") == "1"
+# Fuse the LoRA into the transformer weights instead of running the PEFT layers on every step
+FUSE_LORA = os.environ.get("FUSE_LORA", "1") == "1"
+# Load the transformer and the T5 text encoder with "int8" or "int4" weight-only quantization, empty for bfloat16
+QUANTIZATION = os.environ.get("QUANTIZATION", "")
+# Where the quantized checkpoints are written on the first start and read on the next ones
+QUANTIZED_CACHE_DIR = os.environ.get("QUANTIZED_CACHE_DIR", "quantized")
+# GPU memory the pipeline may use, 0 for the whole device. Picks VAE tiling, batch slicing or CPU offload to fit it
+MEMORY_BUDGET_GB = float(os.environ.get("MEMORY_BUDGET_GB", "0"))
+# Skip the transformer blocks after the first on steps where the first block's residual changed less than
+# this (relative), or only run them every STEP_CACHE_INTERVAL steps. Both 0 keeps every step exact
+STEP_CACHE_THRESHOLD = float(os.environ.get("STEP_CACHE_THRESHOLD", "0"))
+STEP_CACHE_INTERVAL = int(os.environ.get("STEP_CACHE_INTERVAL", "0"))
+# The settings above that change the generated pixels, when not at their exact default. They are part of the
+# result cache keys, so outputs computed under other settings are never served across restarts
+OUTPUT_SETTINGS = {
+    name: value
+    for name, value in (("quantization", QUANTIZATION), ("step_cache_threshold", STEP_CACHE_THRESHOLD), ("step_cache_interval", STEP_CACHE_INTERVAL))
+    if value
+}
+
+_pipe = None
+_prompt_cache = None
+_fused_lora = None
+_step_cache = None
+_planner = MemoryPlanner(budget_bytes=int(MEMORY_BUDGET_GB * GB) or None, text_encoders_resident=not OFFLOAD_TEXT_ENCODERS, weight_ratio=WEIGHT_RATIO.get(QUANTIZATION, 1.0))
+# Modules kept off the GPU outside the offload modes
+_CPU_COMPONENTS = ("text_encoder", "text_encoder_2") if OFFLOAD_TEXT_ENCODERS else ()
+_lock = threading.Lock()
+# Stage timer of the pipeline call running on the current thread, read by the VAE hooks
+_timing = threading.local()
+
+# Seconds spent in each cold start phase: load, lora_attach, prompt_embeddings, first_inference
+COLD_START = {}
+# Bytes of weights held by the transformer and text encoders once loaded
+WEIGHT_BYTES = {}
+
+
+@dataclass
+class RelightRequest:
+    image: Image.Image
+    prompt: str
+    seed: int
+    guidance_scale: float
+    lora_weight: float = LORA_WEIGHT
+    trace: object = metrics.NULL_TRACE
+    queued_at: float = field(default_factory=time.perf_counter)
+    # Called with `(preview_image, step)` every `preview_every` steps while denoising
+    on_preview: object = None
+    preview_every: int = 0
+    # Called with `(steps_done, total_steps)` after every denoising step
+    on_step: object = None
+    # Set when the caller went away, the batch stops once all its requests are cancelled
+    cancelled: threading.Event = field(default_factory=threading.Event)
+
+
+@dataclass
+class SweepRequest:
+    """One image relit with several `(prompt, seed)` variants, sharing its VAE-encoded conditioning"""
+    image: Image.Image
+    variants: list
+    guidance_scale: float
+    lora_weight: float = LORA_WEIGHT
+    trace: object = metrics.NULL_TRACE
+    queued_at: float = field(default_factory=time.perf_counter)
+    # Called with `(steps_done, total_steps)` over all the denoising calls of the sweep
+    on_step: object = None
+    cancelled: threading.Event = field(default_factory=threading.Event)
+
+
+class RelightCancelled(Exception):
+    """Raised from the step callback when every request of a batch was cancelled"""
+
+
+class _RunTimer:
+    """Splits the time of one pipeline call into stages and steps for every request of the batch"""
+
+    def __init__(self, requests):
+        self.traces = [request.trace for request in requests]
+        self.mark = self._now()
+
+    @staticmethod
+    def _now():
+        # Kernels run asynchronously, wait for them so time lands in the right stage
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def start(self):
+        self.mark = self._now()
+
+    def stop(self, stage):
+        now = self._now()
+        for trace in self.traces:
+            trace.add(stage, now - self.mark)
+        self.mark = now
+
+    def on_step_end(self, pipe, step, timestep, callback_kwargs):
+        now = self._now()
+        for trace in self.traces:
+            trace.step(now - self.mark)
+            trace.add("denoise", now - self.mark)
+        self.mark = now
+        return callback_kwargs
+
+    def after_preview(self, pipe, step, timestep, callback_kwargs):
+        # Keeps the preview decode out of the next step's time
+        self.stop("preview")
+        return callback_kwargs
+
+
+def _step_callbacks(requests, callbacks):
+    """Chain the step callbacks of a batch, report progress and abort once every request was cancelled"""
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        if all(request.cancelled.is_set() for request in requests):
+            raise RelightCancelled()
+        for request in requests:
+            if request.on_step is not None:
+                request.on_step(step + 1, pipe.num_timesteps)
+        for callback in callbacks:
+            callback_kwargs = callback(pipe, step, timestep, callback_kwargs)
+        return callback_kwargs
+    return on_step_end
+
+
+def _install_vae_timers(pipe):
+    """Time the VAE encoder and decoder through forward hooks, only while a `_RunTimer` is active"""
+    for module, stage in ((pipe.vae.encoder, "vae_encode"), (pipe.vae.decoder, "vae_decode")):
+        def pre_hook(module, args):
+            timer = getattr(_timing, "timer", None)
+            if timer is not None:
+                timer.start()
+
+        def hook(module, args, output, stage=stage):
+            timer = getattr(_timing, "timer", None)
+            if timer is not None:
+                timer.stop(stage)
+
+        module.register_forward_pre_hook(pre_hook)
+        module.register_forward_hook(hook)
+
+
+class StubPipeline:
+    """
+    Stand-in for `FluxKontextPipeline` that runs on CPU without any weights.
+
+    It accepts the same arguments as the real pipeline in `run_batch` and returns the
+    input images resized to the requested resolution with a warm tint, which is enough
+    to exercise everything around the model: batching, caching, I/O and the CLI. There
+    is no VAE, the "latents" of an image are its pixels, and no LoRA to weight.
+    """
+
+    device = torch.device("cpu")
+    dtype = torch.float32
+
+    def __init__(self):
+        self.image_processor = SimpleNamespace(preprocess=lambda pixels, height, width: pixels)
+
+    def encode_prompt(self, prompt, prompt_2=None, device=None, **kwargs):
+        prompts = [prompt] if isinstance(prompt, str) else prompt
+        return torch.zeros(len(prompts), 1, 8), torch.zeros(len(prompts), 8), None
+
+    def _encode_vae_image(self, image, generator=None):
+        return image
+
+    def set_adapters(self, adapter_names, adapter_weights=None):
+        pass
+
+    def __call__(self, image, width, height, prompt_embeds, output_type="pil", **kwargs):
+        images = to_images(image)
+        if len(images) == 1:
+            images *= len(prompt_embeds)
+        tint = Image.new("RGB", (width, height), (255, 160, 60))
+        images = [Image.blend(img.resize((width, height)), tint, 0.2) for img in images]
+        return SimpleNamespace(images=to_tensor(images, self.device, self.dtype) if output_type == "pt" else images)
+
+
+def _device(pipe):
+    # Under CPU offload the modules sit on the CPU, `_execution_device` is where they run
+    return getattr(pipe, "_execution_device", pipe.device)
+
+
+def _offloaded(pipe):
+    """Whether accelerate hooks place the modules of `pipe`, which must then not be moved by hand"""
+    return getattr(pipe, "_execution_mode", None) in OFFLOAD_MODES
+
+
+def _encode_prompt(pipe, prompts, offload=False):
+    """Run the T5 and CLIP text encoders, bringing them back to the GPU for the call with `offload`"""
+    offload = offload and not _offloaded(pipe)
+    if offload:
+        pipe.text_encoder.to("cuda")
+        pipe.text_encoder_2.to("cuda")
+    with torch.inference_mode():
+        prompt_embeds, pooled_prompt_embeds, _ = pipe.encode_prompt(prompt=prompts, prompt_2=None, device=_device(pipe))
+    if offload:
+        pipe.text_encoder.to("cpu")
+        pipe.text_encoder_2.to("cpu")
+    return prompt_embeds, pooled_prompt_embeds
+
+
+def _load_quantized_pipeline():
+    """FLUX.1-Kontext with its transformer and T5 encoder quantized to QUANTIZATION, from the local cache when possible"""
+    from transformers import T5Config, T5EncoderModel
+
+    if QUANTIZATION not in MODES:
+        raise ValueError(f"QUANTIZATION must be one of {', '.join(MODES)}, got {QUANTIZATION!r}")
+
+    def cache_path(component):
+        return os.path.join(QUANTIZED_CACHE_DIR, f"{MODEL_ID.replace('/', '--')}-{component}-{QUANTIZATION}.safetensors")
+
+    transformer = load_quantized(
+        cache_path("transformer"),
+        lambda: FluxTransformer2DModel.from_pretrained(MODEL_ID, subfolder="transformer", torch_dtype=torch.bfloat16),
+        lambda: FluxTransformer2DModel.from_config(FluxTransformer2DModel.load_config(MODEL_ID, subfolder="transformer")),
+        QUANTIZATION,
+        ("transformer_blocks.", "single_transformer_blocks."),
+    )
+    text_encoder_2 = load_quantized(
+        cache_path("text_encoder_2"),
+        lambda: T5EncoderModel.from_pretrained(MODEL_ID, subfolder="text_encoder_2", torch_dtype=torch.bfloat16),
+        lambda: T5EncoderModel(T5Config.from_pretrained(MODEL_ID, subfolder="text_encoder_2")),
+        QUANTIZATION,
+        ("encoder.block.",),
+    )
+    return FluxKontextPipeline.from_pretrained(MODEL_ID, transformer=transformer, text_encoder_2=text_encoder_2, torch_dtype=torch.bfloat16)
+
+
+def get_pipeline():
+    """Return the relighting pipeline, loading it and attaching the LoRA on first use"""
+    global _pipe, _prompt_cache, _fused_lora, _step_cache
+    if _pipe is not None:
+        return _pipe
+    with _lock:
+        if _pipe is None:
+            start = time.perf_counter()
+            if QUANTIZATION:
+                pipe = _load_quantized_pipeline()
+            else:
+                pipe = FluxKontextPipeline.from_pretrained(MODEL_ID, torch_dtype=torch.bfloat16)
+            if _planner.fits_on_device():
+                pipe.to("cuda")
+            else:
+                # The weights alone exceed MEMORY_BUDGET_GB: they stay on the CPU and offload hooks place the
+                # modules from the start. Counting the text encoders as resident keeps the planner off the
+                # GPU-resident modes, which would move the whole pipeline to the device
+                _planner.text_encoders_resident = True
+                apply_plan(pipe, MODEL_OFFLOAD)
+            COLD_START["load"] = time.perf_counter() - start
+            for component in ("transformer", "text_encoder", "text_encoder_2"):
+                WEIGHT_BYTES[component] = model_bytes(getattr(pipe, component))
+
+            start = time.perf_counter()
+            pipe.load_lora_weights(LORA_ID, weight_name=LORA_WEIGHT_NAME, adapter_name="lora")
+            # Quantized weights can't take the LoRA delta in place, PEFT runs it next to them instead
+            if FUSE_LORA and not QUANTIZATION:
+                _fused_lora = FusedLora(pipe.transformer, adapter_name="lora", strength=LORA_WEIGHT)
+            else:
+                pipe.set_adapters(["lora"], adapter_weights=[LORA_WEIGHT])
+            COLD_START["lora_attach"] = time.perf_counter() - start
+
+            if STEP_CACHE_THRESHOLD or STEP_CACHE_INTERVAL:
+                _step_cache = StepCache(threshold=STEP_CACHE_THRESHOLD, interval=STEP_CACHE_INTERVAL or None).attach(pipe.transformer)
+
+            if metrics.ENABLED:
+                _install_vae_timers(pipe)
+
+            start = time.perf_counter()
+            # The text encoders are still on the device after loading: every preset chunk is encoded in place,
+            # and only once they are offloaded do custom prompts bring them back for each call
+            prompt_cache = PromptEmbeddingCache(lambda prompts: _encode_prompt(pipe, prompts))
+            prompt_cache.precompute(preset_prompts(), path=PROMPT_EMBEDS_PATH)
+            if OFFLOAD_TEXT_ENCODERS and not _offloaded(pipe):
+                pipe.text_encoder.to("cpu")
+                pipe.text_encoder_2.to("cpu")
+                prompt_cache.encode_fn = lambda prompts: _encode_prompt(pipe, prompts, offload=True)
+            COLD_START["prompt_embeddings"] = time.perf_counter() - start
+
+            _prompt_cache = prompt_cache
+            _pipe = pipe
+    return _pipe
+
+
+def set_pipeline(pipe, planner=None):
+    """
+    Use `pipe` instead of loading FLUX.1-Kontext, e.g. a `StubPipeline` on a CPU-only box.
+
+    Without a `planner` every batch runs as one call, as loaded. The LoRA strength is set
+    through `pipe.set_adapters` and the step cache is off.
+    """
+    global _pipe, _prompt_cache, _planner, _fused_lora, _step_cache
+    with _lock:
+        _prompt_cache = PromptEmbeddingCache(lambda prompts: _encode_prompt(pipe, prompts))
+        _planner = planner
+        _fused_lora = None
+        _step_cache = None
+        _pipe = pipe
+
+
+def get_prompt_cache():
+    get_pipeline()
+    return _prompt_cache
+
+
+def set_lora_strength(strength):
+    """Switch the relighting LoRA strength, in place when it is fused"""
+    if _fused_lora is not None:
+        if getattr(_pipe, "_execution_mode", None) == SEQUENTIAL_OFFLOAD and strength != _fused_lora.strength:
+            # Sequential offload keeps the weights on the meta device, removing the hooks puts them back on the CPU
+            _pipe.remove_all_hooks()
+            _fused_lora.set_strength(strength)
+            _pipe.enable_sequential_cpu_offload()
+        else:
+            _fused_lora.set_strength(strength)
+    else:
+        _pipe.set_adapters(["lora"], adapter_weights=[strength])
+
+
+def _pixels(pipe, images):
+    """Input images as a tensor on the pipeline's device, which it preprocesses without going through NumPy"""
+    return to_tensor(images, _device(pipe), pipe.dtype)
+
+
+def _encode_image(pipe, image):
+    """VAE latents of `image`, which the pipeline accepts in place of the image and repeats to the batch size"""
+    width, height = image.size
+    with torch.inference_mode():
+        pixels = pipe.image_processor.preprocess(_pixels(pipe, [image]), height, width)
+        return pipe._encode_vae_image(pixels, generator=None)
+
+
+def _run_chunk(pipe, requests, embeds, width, height, image=None):
+    """
+    Run one denoising call over `requests`, timing its stages and steps when metrics are enabled.
+
+    `image` is the conditioning shared by the whole call, by default every request's own image.
+    """
+    device = _device(pipe)
+    callbacks = []
+    if metrics.ENABLED:
+        _timing.timer = timer = _RunTimer(requests)
+        callbacks.append(timer.on_step_end)
+    if any(request.on_preview is not None and request.preview_every for request in requests):
+        callbacks.append(PreviewStreamer(requests, height, width).on_step_end)
+        if metrics.ENABLED:
+            callbacks.append(timer.after_preview)
+
+    if _step_cache is not None:
+        _step_cache.reset()
+        skipped = _step_cache.skipped_steps
+    try:
+        images = pipe(
+            image=_pixels(pipe, [request.image for request in requests]) if image is None else image,
+            prompt_embeds=torch.cat([prompt_embeds for prompt_embeds, _ in embeds]).to(device),
+            pooled_prompt_embeds=torch.cat([pooled_prompt_embeds for _, pooled_prompt_embeds in embeds]).to(device),
+            guidance_scale=requests[0].guidance_scale,
+            width=width,
+            height=height,
+            max_area=width * height,
+            _auto_resize=False,
+            generator=[torch.Generator().manual_seed(request.seed) for request in requests],
+            callback_on_step_end=_step_callbacks(requests, callbacks),
+            # Kept on the device as a tensor, so it crosses to the CPU as uint8
+            output_type="pt",
+        ).images
+        images = to_images(images)
+    finally:
+        _timing.timer = None
+
+    if metrics.ENABLED:
+        # Whatever is left after the last step and the VAE decode: postprocessing to PIL
+        timer.stop("postprocess")
+    if _step_cache is not None:
+        skipped = _step_cache.skipped_steps - skipped
+        for request in requests:
+            request.trace.set(skipped_steps=skipped, skipped_blocks=skipped * _step_cache.cached_blocks)
+    return images
+
+
+def run_batch(requests):
+    """
+    Run requests sharing a resolution, guidance scale and LoRA strength as batched denoising calls.
+
+    The memory planner picks the execution mode for the resolution and batch size, and
+    splits the batch into several calls when it does not fit in one.
+    """
+    if isinstance(requests[0], SweepRequest):
+        return [run_sweep(sweep) for sweep in requests]
+    pipe = get_pipeline()
+    width, height = requests[0].image.size
+    plan = None
+    if _planner is not None:
+        plan = _planner.plan(width, height, len(requests))
+        apply_plan(pipe, plan.mode, cpu_components=_CPU_COMPONENTS)
+    set_lora_strength(requests[0].lora_weight)
+    start = time.perf_counter()
+    for request in requests:
+        request.trace.add("queue", start - request.queued_at)
+    embeds = [_prompt_cache.get(request.prompt) for request in requests]
+    for request in requests:
+        request.trace.add("text_encoding", time.perf_counter() - start)
+
+    if metrics.ENABLED and torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    chunk_size = plan.batch_size if plan else len(requests)
+    images = []
+    for i in range(0, len(requests), chunk_size):
+        images += _run_chunk(pipe, requests[i:i + chunk_size], embeds[i:i + chunk_size], width, height)
+
+    if metrics.ENABLED:
+        peak_memory = torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None
+        for request in requests:
+            request.trace.set(
+                batch_size=len(requests),
+                chunk_size=chunk_size,
+                execution_mode=plan.mode if plan else "plain",
+                estimated_memory_bytes=plan.estimated_bytes if plan else None,
+                peak_cuda_memory_bytes=peak_memory,
+            )
+    return images
+
+
+def run_sweep(sweep):
+    """
+    Relight one image with every variant of `sweep`, returning one image per variant.
+
+    The image is VAE-encoded once and its latents condition every variant. Variants run
+    batched in as few denoising calls as the memory planner allows.
+    """
+    pipe = get_pipeline()
+    width, height = sweep.image.size
+    plan = None
+    if _planner is not None:
+        plan = _planner.plan(width, height, len(sweep.variants))
+        apply_plan(pipe, plan.mode, cpu_components=_CPU_COMPONENTS)
+    set_lora_strength(sweep.lora_weight)
+    sweep.trace.add("queue", time.perf_counter() - sweep.queued_at)
+    with sweep.trace.stage("text_encoding"):
+        embeds = [_prompt_cache.get(prompt) for prompt, _ in sweep.variants]
+    with sweep.trace.stage("vae_encode"):
+        conditioning = _encode_image(pipe, sweep.image)
+
+    requests = [
+        RelightRequest(sweep.image, prompt, seed, sweep.guidance_scale, lora_weight=sweep.lora_weight, cancelled=sweep.cancelled)
+        for prompt, seed in sweep.variants
+    ]
+    if metrics.ENABLED and torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    chunk_size = plan.batch_size if plan else len(requests)
+    calls = range(0, len(requests), chunk_size)
+    images = []
+    for call, i in enumerate(calls):
+        chunk = requests[i:i + chunk_size]
+        # Only one request per call carries the sweep trace, so stages add up over calls instead of over variants
+        chunk[0].trace = sweep.trace
+        if sweep.on_step is not None:
+            chunk[0].on_step = lambda steps_done, total_steps, call=call: sweep.on_step(call * total_steps + steps_done, len(calls) * total_steps)
+        images += _run_chunk(pipe, chunk, embeds[i:i + chunk_size], width, height, image=conditioning)
+
+    if metrics.ENABLED:
+        sweep.trace.set(
+            variants=len(requests),
+            chunk_size=chunk_size,
+            execution_mode=plan.mode if plan else "plain",
+            peak_cuda_memory_bytes=torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None,
+        )
+    return images
+
+
+def _detach(request):
+    """`request` without its event, callbacks and trace, which cannot be pickled into a ZeroGPU worker"""
+    fields = dict(trace=metrics.NULL_TRACE, cancelled=None, on_step=None)
+    if isinstance(request, RelightRequest):
+        fields.update(on_preview=None, preview_every=request.preview_every if request.on_preview is not None else 0)
+    return replace(request, **fields)
+
+
+def stream_batch(requests):
+    """
+    `run_batch` as a generator of plain data, the function ZeroGPU runs on the GPU.
+
+    ZeroGPU runs it in a forked worker, pickling its arguments and everything it yields,
+    so it takes requests stripped by `relay_batch` and yields `("step", steps_done, total_steps)`,
+    `("preview", index, image, step)` and finally `("result", images, traces)`, with the
+    worker's timings of each request. Nothing reaches the worker once the batch started:
+    it runs to completion even if every request is cancelled meanwhile.
+    """
+    events = queue.Queue()
+    requests = [replace(request, trace=metrics.trace(), cancelled=threading.Event()) for request in requests]
+    requests[0].on_step = lambda steps_done, total_steps: events.put(("step", steps_done, total_steps))
+    if isinstance(requests[0], RelightRequest):
+        for index, request in enumerate(requests):
+            if request.preview_every:
+                request.on_preview = lambda image, step, index=index: events.put(("preview", index, image, step))
+
+    def run():
+        try:
+            events.put(("result", run_batch(requests), [request.trace for request in requests]))
+        except Exception as e:
+            events.put(("error", e))
+
+    threading.Thread(target=run, name="relight-gpu-batch", daemon=True).start()
+    while True:
+        event = events.get()
+        if event[0] == "error":
+            raise event[1]
+        yield event
+        if event[0] == "result":
+            return
+
+
+def relay_batch(stream, requests):
+    """
+    Run `requests` through `stream`, a `spaces.GPU` wrapped `stream_batch`, and return one result per request.
+
+    Only plain data crosses into the worker: events, callbacks and traces stay in this
+    process and are fed from what the worker yields. Requests cancelled while queued
+    are dropped by the scheduler before they get here.
+    """
+    for event in stream([_detach(request) for request in requests]):
+        kind = event[0]
+        if kind == "step":
+            for request in requests:
+                if request.on_step is not None:
+                    request.on_step(*event[1:])
+        elif kind == "preview":
+            _, index, image, step = event
+            if requests[index].on_preview is not None:
+                requests[index].on_preview(image, step)
+        else:
+            _, results, traces = event
+            for request, trace in zip(requests, traces):
+                request.trace.merge(trace)
+            return results
+
+def warm_up(size=(1024, 1024)):
+    """Load the pipeline and run a first inference so CUDA kernels are initialised before traffic arrives"""
+    get_pipeline()
+    start = time.perf_counter()
+    run_batch([RelightRequest(Image.new("RGB", size), preset_prompts()[0], 0, 2.5)])
+    COLD_START["first_inference"] = time.perf_counter() - start
+    return dict(COLD_START)
@@ -0,0 +1,91 @@
+import torch
+from PIL import Image
+
+# Linear approximation of the FLUX VAE decoder: each of the 16 latent channels contributes
+# a fixed RGB colour (factors from ComfyUI's Flux latent format)
+FLUX_LATENT_RGB_FACTORS = [
+    [-0.0346, 0.0244, 0.0681],
+    [0.0034, 0.0210, 0.0687],
+    [0.0275, -0.0668, -0.0433],
+    [-0.0174, 0.0160, 0.0617],
+    [0.0859, 0.0721, 0.0329],
+    [0.0004, 0.0383, 0.0115],
+    [0.0405, 0.0861, 0.0915],
+    [-0.0236, -0.0185, -0.0259],
+    [-0.0245, 0.0250, 0.1180],
+    [0.1008, 0.0755, -0.0421],
+    [-0.0515, 0.0201, 0.0011],
+    [0.0428, -0.0012, -0.0036],
+    [0.0817, 0.0765, 0.0749],
+    [-0.1264, -0.0522, -0.1103],
+    [-0.0280, -0.0881, -0.0499],
+    [-0.1262, -0.0982, -0.0778],
+]
+FLUX_LATENT_RGB_BIAS = [-0.0329, -0.0718, -0.0851]
+
+
+def unpack_latents(latents, height, width, vae_scale_factor=8):
+    """(batch, tokens, channels * 4) packed FLUX latents to (batch, channels, height / 8, width / 8)"""
+    batch_size, _, channels = latents.shape
+    latent_height = 2 * (int(height) // (vae_scale_factor * 2))
+    latent_width = 2 * (int(width) // (vae_scale_factor * 2))
+    latents = latents.view(batch_size, latent_height // 2, latent_width // 2, channels // 4, 2, 2)
+    return latents.permute(0, 3, 1, 4, 2, 5).reshape(batch_size, channels // 4, latent_height, latent_width)
+
+
+def latents_to_images(latents):
+    """
+    Cheap previews of unpacked latents, one PIL image per sample at latent resolution.
+
+    Costs one small matmul instead of a VAE decode. Latents without the 16 FLUX channels
+    (e.g. tiny test models) are shown as grayscale.
+    """
+    latents = latents.float()
+    if latents.shape[1] == len(FLUX_LATENT_RGB_FACTORS):
+        factors = torch.tensor(FLUX_LATENT_RGB_FACTORS, device=latents.device)
+        bias = torch.tensor(FLUX_LATENT_RGB_BIAS, device=latents.device)
+        rgb = torch.einsum("bchw,cr->bhwr", latents, factors) + bias
+    else:
+        rgb = latents.mean(dim=1, keepdim=True).permute(0, 2, 3, 1).expand(-1, -1, -1, 3)
+    rgb = ((rgb.clamp(-1, 1) + 1) * 127.5).to(torch.uint8).cpu().numpy()
+    return [Image.fromarray(sample) for sample in rgb]
+
+
+class PreviewStreamer:
+    """
+    Step callback sending a preview of the predicted final image to each request every few steps.
+
+    The current latents are still mostly noise early on, so the preview extrapolates the
+    clean image from the last two steps: with flow matching `x_t = (1 - s) * x_0 + s * noise`,
+    the velocity is the latent difference over the sigma difference and
+    `x_0 = x_t - s * velocity`.
+
+    Args:
+        requests (list): Requests of the batch, the ones with an `on_preview` callback and a
+            positive `preview_every` receive previews.
+        height (int): Output height in pixels.
+        width (int): Output width in pixels.
+    """
+
+    def __init__(self, requests, height, width):
+        self.requests = requests
+        self.height = height
+        self.width = width
+        self.previous = None
+
+    def on_step_end(self, pipe, step, timestep, callback_kwargs):
+        latents = callback_kwargs["latents"]
+        due = [
+            index for index, request in enumerate(self.requests)
+            if request.on_preview is not None and request.preview_every and (step + 1) % request.preview_every == 0
+        ]
+        if due and self.previous is not None:
+            sigmas = pipe.scheduler.sigmas
+            sigma, previous_sigma = sigmas[step + 1].item(), sigmas[step].item()
+            velocity = (latents[due].float() - self.previous[due].float()) / (sigma - previous_sigma)
+            clean = latents[due].float() - sigma * velocity
+            previews = latents_to_images(unpack_latents(clean, self.height, self.width, pipe.vae_scale_factor))
+            for index, preview in zip(due, previews):
+                self.requests[index].on_preview(preview, step + 1)
+        self.previous = latents.detach().clone()
+        return callback_kwargs
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class PromptEmbeddingCache:
+    """
+    Keeps the T5/CLIP outputs of FLUX.1-Kontext keyed by the final prompt string.
+
+    Preset prompts (every illumination x direction combination) are pinned and never
+    evicted; they are precomputed once and can be persisted to disk so later starts only
+    load them. Custom prompts go into a bounded LRU. Embeddings are stored on the CPU and
+    moved to the pipeline device by the caller.
+
+    Args:
+        encode_fn (callable): Takes a list of prompts and returns a
+            `(prompt_embeds, pooled_prompt_embeds)` pair batched along dim 0.
+        max_custom (int): Maximum number of custom prompts kept in the LRU.
+    """
+
+    def __init__(self, encode_fn, max_custom=64):
+        self.encode_fn = encode_fn
+        self.max_custom = max_custom
+        self.presets = {}
+        self.custom = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _encode(self, prompts):
+        prompt_embeds, pooled_prompt_embeds = self.encode_fn(prompts)
+        return [
+            (prompt_embeds[i:i + 1].to("cpu").clone(), pooled_prompt_embeds[i:i + 1].to("cpu").clone())
+            for i in range(len(prompts))
+        ]
+
+    def precompute(self, prompts, path=None, batch_size=16):
+        """Fills the pinned preset tier, loading from and saving to `path` when given."""
+        if path and os.path.exists(path):
+            self.presets.update(torch.load(path))
+        missing = [p for p in dict.fromkeys(prompts) if p not in self.presets]
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            self.presets.update(zip(chunk, self._encode(chunk)))
+        if path and missing:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            torch.save(self.presets, path)
+
+    def get(self, prompt):
+        """Returns `(prompt_embeds, pooled_prompt_embeds)` for a single prompt."""
+        with self._lock:
+            if prompt in self.presets:
+                self.hits += 1
+                return self.presets[prompt]
+            if prompt in self.custom:
+                self.hits += 1
+                self.custom.move_to_end(prompt)
+                return self.custom[prompt]
+            self.misses += 1
+            # Encoding happens under the lock so concurrent misses don't fight over the
+            # text encoders when they are offloaded
+            embeds = self._encode([prompt])[0]
+            self.custom[prompt] = embeds
+            if len(self.custom) > self.max_custom:
+                self.custom.popitem(last=False)
+            return embeds
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "presets": len(self.presets),
+            "custom": len(self.custom),
+        }
@@ -0,0 +1,157 @@
+import os
+
+import torch
+import torch.nn.functional as F
+from safetensors import safe_open
+from safetensors.torch import load_model, save_model
+from torch import nn
+
+MODES = ("int8", "int4")
+# Weights in int4 are quantized in groups of this many input features, each group with its own scale
+GROUP_SIZE = 64
+# Size of the quantized linear weights relative to bfloat16, scales included
+WEIGHT_RATIO = {"int8": 0.5 + 2 / 3072, "int4": 0.25 + 2 / GROUP_SIZE}
+# safetensors dtype names of the tensors a quantized checkpoint holds
+DTYPES = {"BF16": torch.bfloat16, "F16": torch.float16, "F32": torch.float32, "I8": torch.int8, "U8": torch.uint8}
+
+
+def quantize_weight(weight, mode):
+    """Symmetric weight-only quantization, returns `(qweight, scale)` with the scale in the weight's dtype"""
+    dtype = weight.dtype
+    weight = weight.detach().float()
+    if mode == "int8":
+        # One scale per output channel, rounded to the dtype it is stored in before quantizing against it
+        scale = (weight.abs().amax(dim=1, keepdim=True).clamp(min=1e-8) / 127).to(dtype).float()
+        return torch.round(weight / scale).clamp(-127, 127).to(torch.int8), scale.to(dtype)
+    out_features, in_features = weight.shape
+    groups = weight.reshape(out_features, in_features // GROUP_SIZE, GROUP_SIZE)
+    scale = (groups.abs().amax(dim=2, keepdim=True).clamp(min=1e-8) / 7).to(dtype).float()
+    q = (torch.round(groups / scale).clamp(-8, 7) + 8).to(torch.uint8).reshape(out_features, in_features)
+    # Two 4-bit values per byte, even input features in the low nibble
+    return q[:, 0::2] | (q[:, 1::2] << 4), scale.to(dtype)
+
+
+def dequantize_weight(qweight, scale, mode, dtype=torch.bfloat16):
+    if mode == "int8":
+        return (qweight.to(scale.dtype) * scale).to(dtype)
+    out_features = qweight.shape[0]
+    q = torch.stack([qweight & 0x0F, qweight >> 4], dim=2).reshape(out_features, -1).to(scale.dtype) - 8
+    return (q.reshape(out_features, -1, GROUP_SIZE) * scale).reshape(out_features, -1).to(dtype)
+
+
+class QuantizedLinear(nn.Linear):
+    """
+    `nn.Linear` holding int8 or packed int4 weights, dequantized on the fly in every forward.
+
+    It subclasses `nn.Linear` so PEFT wraps it like any linear layer and LoRA adapters load
+    onto it unchanged: the adapters stay in bfloat16 next to the quantized base weight.
+    `weight` dequantizes the whole matrix, for code that inspects it, but is never stored.
+    """
+
+    def __init__(self, in_features, out_features, mode, bias=True, dtype=torch.bfloat16, device=None):
+        nn.Module.__init__(self)
+        if mode == "int4" and in_features % GROUP_SIZE:
+            raise ValueError(f"int4 needs in_features divisible by {GROUP_SIZE}, got {in_features}")
+        self.in_features = in_features
+        self.out_features = out_features
+        self.mode = mode
+        if mode == "int8":
+            self.register_buffer("qweight", torch.empty(out_features, in_features, dtype=torch.int8, device=device))
+            self.register_buffer("scale", torch.empty(out_features, 1, dtype=dtype, device=device))
+        else:
+            self.register_buffer("qweight", torch.empty(out_features, in_features // 2, dtype=torch.uint8, device=device))
+            self.register_buffer("scale", torch.empty(out_features, in_features // GROUP_SIZE, 1, dtype=dtype, device=device))
+        self.bias = nn.Parameter(torch.empty(out_features, dtype=dtype, device=device), requires_grad=False) if bias else None
+
+    @classmethod
+    def from_linear(cls, linear, mode):
+        weight = linear.weight
+        layer = cls(linear.in_features, linear.out_features, mode, bias=linear.bias is not None, dtype=weight.dtype, device=weight.device)
+        qweight, scale = quantize_weight(weight, mode)
+        layer.qweight.copy_(qweight)
+        layer.scale.copy_(scale)
+        if linear.bias is not None:
+            layer.bias.data.copy_(linear.bias.data)
+        return layer
+
+    @property
+    def weight(self):
+        return dequantize_weight(self.qweight, self.scale, self.mode, self.scale.dtype)
+
+    def forward(self, x):
+        return F.linear(x, dequantize_weight(self.qweight, self.scale, self.mode, x.dtype), self.bias)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, mode={self.mode}, bias={self.bias is not None}"
+
+
+def quantize_model(model, mode, prefixes, empty=False):
+    """
+    Replace the `nn.Linear` layers of `model` whose name starts with one of `prefixes` by
+    `QuantizedLinear`. With `empty`, the layers are only allocated, to load a quantized
+    checkpoint into.
+    """
+    for name, module in list(model.named_modules()):
+        if type(module) is not nn.Linear or not name.startswith(prefixes):
+            continue
+        parent_name, _, child = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        if empty:
+            layer = QuantizedLinear(module.in_features, module.out_features, mode, bias=module.bias is not None, dtype=module.weight.dtype, device="cpu")
+        else:
+            layer = QuantizedLinear.from_linear(module, mode)
+        setattr(parent, child, layer)
+    return model
+
+
+def model_bytes(model):
+    """Bytes held by the parameters and buffers of `model`"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def _match_checkpoint_dtypes(model, path):
+    """
+    Give every tensor of `model` the dtype it has in the checkpoint at `path`.
+
+    `load` may keep some modules in float32 where `build().to(torch.bfloat16)` doesn't,
+    e.g. the `wo` layers transformers keeps in float32 in T5 (`_keep_in_fp32_modules`).
+    Loading into bfloat16 tensors would silently cast them, and cached and uncached
+    starts would not compute the same thing.
+    """
+    with safe_open(path, framework="pt") as checkpoint:
+        dtypes = {name: DTYPES[checkpoint.get_slice(name).get_dtype()] for name in checkpoint.keys()}
+    for module_name, module in model.named_modules():
+        for tensors in (module._parameters, module._buffers):
+            for name, tensor in tensors.items():
+                dtype = dtypes.get(f"{module_name}.{name}" if module_name else name)
+                if tensor is not None and dtype is not None and tensor.dtype != dtype:
+                    tensor.data = torch.empty(tensor.shape, dtype=dtype, device=tensor.device)
+
+
+def load_quantized(path, load, build, mode, prefixes):
+    """
+    Load a model quantized to `mode`, from the checkpoint at `path` when it exists.
+
+    Otherwise the model is loaded in full precision with `load`, quantized and written to
+    `path`, so the next start reads the smaller checkpoint and skips quantization. `build`
+    returns the unloaded model from its config; it is instantiated on the meta device and
+    only the quantized layers and the checkpoint tensors are ever allocated, each in the
+    dtype it was saved with. Models with non-persistent buffers would need those
+    recomputed and are not supported.
+    """
+    if os.path.exists(path):
+        with torch.device("meta"):
+            model = build().to(torch.bfloat16)
+        quantize_model(model, mode, prefixes, empty=True)
+        model.to_empty(device="cpu")
+        _match_checkpoint_dtypes(model, path)
+        load_model(model, path)
+        return model.eval()
+
+    model = quantize_model(load(), mode, prefixes)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Written next to the target first, so an interrupted start never leaves a truncated checkpoint behind
+    save_model(model, path + ".tmp", metadata={"quantization": mode})
+    os.replace(path + ".tmp", path)
+    return model.eval()
@@ -0,0 +1,75 @@
+import math
+
+from PIL import Image
+
+# Aspect ratios of the resolutions FLUX.1-Kontext was trained on
+# (PREFERRED_KONTEXT_RESOLUTIONS in diffusers), all close to 1024x1024 pixels
+KONTEXT_RESOLUTIONS = [
+    (672, 1568),
+    (688, 1504),
+    (720, 1456),
+    (752, 1392),
+    (800, 1328),
+    (832, 1248),
+    (880, 1184),
+    (944, 1104),
+    (1024, 1024),
+    (1104, 944),
+    (1184, 880),
+    (1248, 832),
+    (1328, 800),
+    (1392, 752),
+    (1456, 720),
+    (1504, 688),
+    (1568, 672),
+]
+
+
+def make_buckets(max_megapixels=1.0, multiple_of=16):
+    """Scale the Kontext resolutions to a megapixel budget (in units of 1024x1024 pixels)"""
+    budget = max_megapixels * 1024 * 1024
+    buckets = set()
+    for width, height in KONTEXT_RESOLUTIONS:
+        scale = math.sqrt(budget / (width * height))
+        buckets.add((
+            max(multiple_of, int(width * scale) // multiple_of * multiple_of),
+            max(multiple_of, int(height * scale) // multiple_of * multiple_of),
+        ))
+    return sorted(buckets)
+
+
+class ResolutionPolicy:
+    """
+    Snaps every input to one of a fixed set of aspect-ratio buckets under a megapixel budget.
+
+    Running the pipeline on a handful of shapes keeps latency and memory predictable
+    whatever the upload size, lets the scheduler batch requests together and lets
+    compiled graphs be reused.
+
+    Args:
+        max_megapixels (float): Pixel budget of a bucket, in units of 1024x1024 pixels.
+        restore_size (bool): Resize outputs back to the original input dimensions.
+        multiple_of (int): Bucket sides are rounded down to a multiple of this value.
+    """
+
+    def __init__(self, max_megapixels=1.0, restore_size=False, multiple_of=16):
+        self.buckets = make_buckets(max_megapixels, multiple_of)
+        self.restore_size = restore_size
+
+    def bucket_for(self, size):
+        """The bucket whose aspect ratio is closest to `size`"""
+        aspect_ratio = math.log(size[0] / size[1])
+        return min(self.buckets, key=lambda bucket: abs(math.log(bucket[0] / bucket[1]) - aspect_ratio))
+
+    def prepare(self, image):
+        """Resize `image` to its bucket"""
+        bucket = self.bucket_for(image.size)
+        if image.size == bucket:
+            return image
+        return image.resize(bucket, Image.LANCZOS)
+
+    def finalize(self, image, original_size):
+        """Resize a pipeline output back to `original_size` if the policy asks for it"""
+        if not self.restore_size or image.size == tuple(original_size):
+            return image
+        return image.resize(original_size, Image.LANCZOS)
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ResultCache:
+    """
+    Content-addressed cache of encoded relit images with an in-memory tier in front of a disk tier.
+
+    Keys are hashes of the decoded input pixels and of every generation and encoding
+    parameter, so a resubmitted image hits the cache whatever file name or encoding it
+    arrived with. Values are the response bytes exactly as sent, a hit is served without
+    decoding or re-encoding anything. The disk tier is bounded both in bytes and in
+    entries, the least recently used results being evicted first. Recency survives
+    restarts through the file modification times.
+
+    `put` only updates the memory tier on the caller's thread, files are written by a
+    background thread.
+
+    Args:
+        directory (str): Directory holding the cached files.
+        max_bytes (int): Maximum total size of the disk tier.
+        max_entries (int): Maximum number of results on disk.
+        memory_entries (int): Number of results kept in memory.
+    """
+
+    SUFFIX = ".bin"
+
+    def __init__(self, directory, max_bytes=2 * 1024**3, max_entries=2000, memory_entries=32):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.disk = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="result-cache")
+
+        os.makedirs(directory, exist_ok=True)
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith(self.SUFFIX)]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            size = entry.stat().st_size
+            self.disk[entry.name[:-len(self.SUFFIX)]] = size
+            self.bytes_used += size
+
+    @staticmethod
+    def make_key(image, **params):
+        """Hash of the decoded pixels of `image` and of the generation parameters."""
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size}".encode())
+        digest.update(image.tobytes())
+        digest.update(repr(sorted(params.items())).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _remember(self, key, data):
+        self.memory[key] = data
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the bytes cached for `key`, or None."""
+        with self._lock:
+            if key in self.memory:
+                self.hits += 1
+                self.memory.move_to_end(key)
+                if key in self.disk:
+                    self.disk.move_to_end(key)
+                return self.memory[key]
+            if key not in self.disk:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                # The file vanished, forget about it
+                self.bytes_used -= self.disk.pop(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk.move_to_end(key)
+            self._remember(key, data)
+            return data
+
+    def put(self, key, data):
+        """
+        Stores the bytes `data` under `key` and returns a `Future` done once they are on disk.
+
+        The least recently used results are evicted if needed.
+        """
+        with self._lock:
+            self._remember(key, data)
+        return self._writer.submit(self._write, key, data)
+
+    def _write(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            os.replace(tmp_path, path)
+            self.bytes_used -= self.disk.pop(key, 0)
+            size = os.path.getsize(path)
+            self.disk[key] = size
+            self.bytes_used += size
+            while self.disk and (self.bytes_used > self.max_bytes or len(self.disk) > self.max_entries):
+                evicted, evicted_size = self.disk.popitem(last=False)
+                self.memory.pop(evicted, None)
+                self.bytes_used -= evicted_size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(evicted))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.disk),
+            "bytes_used": self.bytes_used,
+            "evictions": self.evictions,
+        }
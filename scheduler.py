@@ -0,0 +1,110 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Priority classes, lower runs first: requests from the UI go ahead of bulk API jobs
+INTERACTIVE = 0
+BULK = 1
+
+
+class _Pending:
+    __slots__ = ("item", "key", "priority", "order", "future", "arrival")
+
+    def __init__(self, item, key, priority, order):
+        self.item = item
+        self.key = key
+        self.priority = priority
+        self.order = order
+        self.future = Future()
+        self.arrival = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.order) < (other.priority, other.order)
+
+
+class MicroBatchScheduler:
+    """
+    Collects requests arriving close together and runs them as batched pipeline calls.
+
+    A background worker takes the oldest waiting request, then keeps collecting for at
+    most `max_wait` seconds counted from that request's arrival. Requests that queued up
+    while the GPU was busy are therefore dispatched without any extra wait, and a lone
+    request on an idle GPU is delayed by `max_wait` at most. Waiting requests are taken
+    by priority class first, then in arrival order. Collected requests are grouped by
+    key (output resolution, guidance scale...) and every group is run as one call.
+    Requests whose future was cancelled or whose `cancelled` event was set while they
+    waited are dropped when collecting and take no batch slot.
+
+    Args:
+        run_batch (callable): Takes a list of requests sharing a key and returns a list
+            with one result per request, in the same order.
+        max_batch_size (int): Maximum number of requests collected per cycle.
+        max_wait (float): Maximum time in seconds a request waits for companions.
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait=0.02):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, item, key=None, priority=INTERACTIVE):
+        """Queues `item` and returns a `Future` resolved with its result."""
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._loop, name="relight-scheduler", daemon=True)
+                self._worker.start()
+        pending = _Pending(item, key, priority, next(self._order))
+        self._queue.put(pending)
+        return pending.future
+
+    def run(self, item, key=None, priority=INTERACTIVE):
+        """Queues `item` and blocks until its result is ready."""
+        return self.submit(item, key, priority).result()
+
+    @staticmethod
+    def _dropped(pending):
+        """Whether the request was cancelled while queued, its future is then cancelled and it takes no batch slot"""
+        cancelled = getattr(pending.item, "cancelled", None)
+        if cancelled is not None and cancelled.is_set():
+            pending.future.cancel()
+        return pending.future.cancelled()
+
+    def _collect(self):
+        first = self._queue.get()
+        while self._dropped(first):
+            first = self._queue.get()
+        batch = [first]
+        deadline = first.arrival + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                pending = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if not self._dropped(pending):
+                batch.append(pending)
+        return batch
+
+    def _loop(self):
+        while True:
+            groups = {}
+            for pending in self._collect():
+                groups.setdefault(pending.key, []).append(pending)
+            for group in groups.values():
+                group = [pending for pending in group if pending.future.set_running_or_notify_cancel()]
+                if not group:
+                    continue
+                try:
+                    results = self.run_batch([pending.item for pending in group])
+                except Exception as e:
+                    for pending in group:
+                        pending.future.set_exception(e)
+                else:
+                    for pending, result in zip(group, results):
+                        pending.future.set_result(result)
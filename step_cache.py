@@ -0,0 +1,135 @@
+import torch
+from torch import nn
+
+
+class _FirstBlock(nn.Module):
+    """Runs the first transformer block and lets the cache decide whether the others run this step"""
+
+    def __init__(self, block, cache):
+        super().__init__()
+        self.block = block
+        self.cache = cache
+
+    def forward(self, hidden_states, encoder_hidden_states, **kwargs):
+        encoder_hidden_states_out, hidden_states_out = self.block(hidden_states=hidden_states, encoder_hidden_states=encoder_hidden_states, **kwargs)
+        self.cache._decide(hidden_states_out - hidden_states)
+        return encoder_hidden_states_out, hidden_states_out
+
+
+class _CachedBlocks(nn.Module):
+    """Every block after the first, replaced by their cached residual on skipped steps"""
+
+    def __init__(self, blocks, cache):
+        super().__init__()
+        self.blocks = nn.ModuleList(blocks)
+        self.cache = cache
+
+    def forward(self, hidden_states, encoder_hidden_states, **kwargs):
+        cache = self.cache
+        if cache.skip:
+            return encoder_hidden_states + cache.encoder_residual, hidden_states + cache.residual
+        hidden_states_in, encoder_hidden_states_in = hidden_states, encoder_hidden_states
+        for block in self.blocks:
+            encoder_hidden_states, hidden_states = block(hidden_states=hidden_states, encoder_hidden_states=encoder_hidden_states, **kwargs)
+        cache.residual = hidden_states - hidden_states_in
+        cache.encoder_residual = encoder_hidden_states - encoder_hidden_states_in
+        return encoder_hidden_states, hidden_states
+
+
+class StepCache:
+    """
+    Skips the transformer blocks after the first on denoising steps where they would barely
+    change the result, reusing the residual they added on the last step they ran.
+
+    On every step the first block always runs. In adaptive mode (`threshold`) its residual
+    is compared with the one from the last fully computed step: when the mean absolute
+    difference relative to it is below `threshold`, the remaining double and single
+    blocks are skipped and their cached residual is added instead. In fixed mode
+    (`interval`) the remaining blocks run every `interval` steps whatever the residuals.
+    Either way the first `warmup` steps, where the image takes shape, always run fully.
+    In adaptive mode at most `max_skips` steps in a row are skipped, in fixed mode the
+    interval alone sets how many.
+
+    Attaching moves the blocks into wrapper modules, so attach after loading LoRA weights
+    and detach before saving the transformer. Call `reset` before every pipeline call.
+
+    Args:
+        threshold (float): Relative change of the first block residual under which a step
+            is skipped. Ignored when `interval` is set.
+        interval (int): Run the remaining blocks every `interval` steps instead.
+        warmup (int): Steps always computed at the start of a call.
+        max_skips (int): Most consecutive steps skipped in adaptive mode.
+    """
+
+    def __init__(self, threshold=0.1, interval=None, warmup=2, max_skips=3):
+        self.threshold = threshold
+        self.interval = interval
+        self.warmup = warmup
+        self.max_skips = max_skips
+        self.transformer = None
+        self.num_double_blocks = 0
+        self.cached_blocks = 0
+        self.steps = 0
+        self.skipped_steps = 0
+        self.reset()
+
+    def attach(self, transformer):
+        """Wrap the blocks of a FluxTransformer2DModel"""
+        if self.transformer is not None:
+            raise RuntimeError("StepCache is already attached")
+        blocks = list(transformer.transformer_blocks)
+        single_blocks = list(transformer.single_transformer_blocks)
+        self.cached_blocks = len(blocks) - 1 + len(single_blocks)
+        transformer.transformer_blocks = nn.ModuleList([_FirstBlock(blocks[0], self), _CachedBlocks(blocks[1:] + single_blocks, self)])
+        transformer.single_transformer_blocks = nn.ModuleList()
+        self.num_double_blocks = len(blocks)
+        self.transformer = transformer
+        return self
+
+    def detach(self):
+        """Put the original blocks back"""
+        transformer = self.transformer
+        first, cached = transformer.transformer_blocks
+        blocks = [first.block] + list(cached.blocks)
+        transformer.transformer_blocks = nn.ModuleList(blocks[:self.num_double_blocks])
+        transformer.single_transformer_blocks = nn.ModuleList(blocks[self.num_double_blocks:])
+        self.transformer = None
+        self.reset()
+
+    def reset(self):
+        """Forget the residuals of the previous pipeline call"""
+        self.step = 0
+        self.skip = False
+        self.consecutive_skips = 0
+        self.reference = None
+        self.residual = None
+        self.encoder_residual = None
+
+    @torch.no_grad()
+    def _decide(self, first_residual):
+        if self.interval:
+            skip = self.step >= self.warmup and (self.step - self.warmup) % self.interval != 0
+        elif self.reference is None or self.reference.shape != first_residual.shape or self.step < self.warmup:
+            skip = False
+        else:
+            change = (first_residual - self.reference).abs().mean() / self.reference.abs().mean()
+            skip = change.item() < self.threshold
+        skip = skip and self.residual is not None and (self.interval or self.consecutive_skips < self.max_skips)
+
+        if skip:
+            self.consecutive_skips += 1
+            self.skipped_steps += 1
+        else:
+            self.consecutive_skips = 0
+            self.reference = first_residual
+        self.skip = skip
+        self.step += 1
+        self.steps += 1
+
+    def stats(self):
+        """Steps seen and skipped since the cache was created, and the transformer blocks skipped with them"""
+        return {
+            "steps": self.steps,
+            "skipped_steps": self.skipped_steps,
+            "skipped_blocks": self.skipped_steps * self.cached_blocks,
+        }
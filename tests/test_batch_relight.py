@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+import batch_relight  # noqa: E402
+import pipeline  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def unload_stub():
+    yield
+    pipeline.set_pipeline(None)
+
+
+@pytest.fixture
+def photos(tmp_path):
+    source = tmp_path / "photos"
+    (source / "nested").mkdir(parents=True)
+    for index in range(7):
+        folder = source / "nested" if index % 3 == 0 else source
+        size = (96, 64) if index % 2 else (64, 96)
+        Image.new("RGB", size, (index * 30, 100, 200)).save(folder / f"photo{index}.png")
+    (source / "notes.txt").write_text("not an image")
+    return source
+
+
+def manifest_lines(output_dir):
+    """Every entry of the progress manifest, None for lines that are not valid JSON"""
+    entries = []
+    with open(output_dir / batch_relight.MANIFEST_NAME) as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                entries.append(None)
+    return entries
+
+
+def run(source, output_dir):
+    batch_relight.main([str(source), "--output-dir", str(output_dir), "--stub", "--batch-size", "2", "--workers", "2", "--max-megapixels", "0.01"])
+
+
+def test_interrupted_run_resumes_without_duplicates_or_gaps(photos, tmp_path, monkeypatch):
+    output_dir = tmp_path / "relit"
+    run_batch = pipeline.run_batch
+    calls = []
+
+    def interrupted(requests):
+        calls.append(len(requests))
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return run_batch(requests)
+
+    monkeypatch.setattr(pipeline, "run_batch", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run(photos, output_dir)
+    monkeypatch.setattr(pipeline, "run_batch", run_batch)
+
+    first = manifest_lines(output_dir)
+    assert len(first) == sum(calls[:2])
+    # A run killed while writing leaves a truncated last line behind
+    with open(output_dir / batch_relight.MANIFEST_NAME, "a") as f:
+        f.write('{"input": "')
+
+    run(photos, output_dir)
+    with open(output_dir / batch_relight.MANIFEST_NAME) as f:
+        assert f.read().endswith("\n")
+    inputs = [path for path, _ in batch_relight.list_inputs(str(photos))]
+    entries = [entry for entry in manifest_lines(output_dir) if entry is not None]
+    assert sorted(entry["input"] for entry in entries) == sorted(inputs)
+    assert entries[:len(first)] == first
+    assert all(os.path.exists(output_dir / entry["output"]) for entry in entries)
+
+    # Everything is done, a third run relights nothing
+    assert batch_relight.relight_directory(str(photos), str(output_dir), log=lambda message: None) == 0
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+peft = pytest.importorskip("peft")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from lora import FusedLora  # noqa: E402
+from tiny import LORA_TARGET_MODULES, tiny_transformer, transformer_inputs  # noqa: E402
+
+
+def transformer_with_lora(dtype=torch.float32):
+    transformer = tiny_transformer().to(dtype)
+    torch.manual_seed(1)
+    # lora_alpha differs from the rank, so a wrong scaling shows
+    transformer.add_adapter(
+        peft.LoraConfig(r=4, lora_alpha=8, target_modules=LORA_TARGET_MODULES, init_lora_weights=False),
+        adapter_name="lora",
+    )
+    return transformer
+
+
+@torch.no_grad()
+def test_fused_output_matches_peft():
+    transformer = transformer_with_lora()
+    inputs = transformer_inputs(transformer)
+    expected = {}
+    for strength in (0.75, 1.0, 0.5):
+        transformer.set_adapters(["lora"], weights=[strength])
+        expected[strength] = transformer(**inputs)[0]
+
+    # The last set_adapters weight (0.5) must not leak into the fused strengths
+    fused_lora = FusedLora(transformer, adapter_name="lora", strength=0.75)
+    for strength in (0.75, 1.0, 0.5, 0.75):
+        fused_lora.set_strength(strength)
+        torch.testing.assert_close(transformer(**inputs)[0], expected[strength], atol=1e-4, rtol=0)
+
+
+@torch.no_grad()
+def test_switching_strengths_never_drifts_the_weights():
+    transformer = transformer_with_lora(torch.bfloat16)
+    base = {name: module.get_base_layer().weight.clone() for name, module in transformer.named_modules() if isinstance(module, peft.tuners.lora.LoraLayer)}
+    fused_lora = FusedLora(transformer, adapter_name="lora", strength=0.75, cache_size=2)
+    fused = [base_layer.weight.clone() for base_layer, *_ in fused_lora.factors]
+
+    for strength in (1.0, 0.5, 1.25, 0.75, 1.0, 0.75) * 5:
+        fused_lora.set_strength(strength)
+    assert all(torch.equal(base_layer.weight, weight) for (base_layer, *_), weight in zip(fused_lora.factors, fused))
+    assert len(fused_lora.corrections) == 2
+
+    fused_lora.set_strength(0.0)
+    weights = dict(transformer.named_modules())
+    assert all(torch.equal(weights[name].weight, weight) for name, weight in base.items())
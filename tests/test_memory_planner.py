@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_planner import GB, MODEL_OFFLOAD, PLAIN, SEQUENTIAL_OFFLOAD, VAE_TILING, MemoryPlanner  # noqa: E402
+
+
+def planner(total_gb, **kwargs):
+    return MemoryPlanner(memory_reporter=lambda: (total_gb * GB, total_gb * GB), **kwargs)
+
+
+def test_large_device_runs_plain_with_the_whole_batch():
+    plan = planner(80).plan(1024, 1024, 4)
+    assert (plan.mode, plan.batch_size) == (PLAIN, 4)
+
+
+def test_modes_are_tried_from_fastest_to_leanest():
+    modes = [planner(total_gb).plan(1024, 1024, 1).mode for total_gb in (80, 40, 30, 8)]
+    assert modes == [PLAIN, VAE_TILING, MODEL_OFFLOAD, SEQUENTIAL_OFFLOAD]
+
+
+def test_batch_is_halved_before_falling_back_to_the_next_mode():
+    plan = planner(48).plan(1024, 1024, 8)
+    assert plan.mode == PLAIN
+    assert plan.batch_size == 2
+    assert plan.estimated_bytes <= 48 * GB * 0.9
+
+
+def test_nothing_fits_falls_back_to_sequential_offload_one_at_a_time():
+    plan = planner(1).plan(2048, 2048, 4)
+    assert (plan.mode, plan.batch_size) == (SEQUENTIAL_OFFLOAD, 1)
+    assert plan.estimated_bytes > 1 * GB
+
+
+def test_explicit_budget_overrides_the_device_total():
+    plan = MemoryPlanner(budget_bytes=8 * GB, memory_reporter=lambda: (80 * GB, 80 * GB)).plan(1024, 1024, 1)
+    assert plan.mode == SEQUENTIAL_OFFLOAD
+
+
+def test_without_an_accelerator_everything_runs_plain():
+    plan = MemoryPlanner(memory_reporter=lambda: None).plan(1024, 1024, 4)
+    assert (plan.mode, plan.batch_size) == (PLAIN, 4)
+
+
+def test_offloaded_text_encoders_leave_room_on_the_device():
+    assert planner(32, text_encoders_resident=False).plan(1024, 1024, 1).mode == PLAIN
+    assert planner(32).plan(1024, 1024, 1).mode == MODEL_OFFLOAD
+
+
+def test_whole_pipeline_is_loaded_on_the_device_only_when_it_fits():
+    assert planner(80).fits_on_device()
+    assert not planner(16).fits_on_device()
+    assert not planner(16, weight_ratio=0.5).fits_on_device()
+    assert planner(16, weight_ratio=0.25).fits_on_device()
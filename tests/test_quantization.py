@@ -0,0 +1,93 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("safetensors")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from torch import nn  # noqa: E402
+
+from quantization import GROUP_SIZE, MODES, QuantizedLinear, dequantize_weight, load_quantized, model_bytes, quantize_weight  # noqa: E402
+
+
+class Blocks(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.blocks = nn.ModuleList([nn.Linear(128, 64), nn.Linear(64, 128)])
+        self.head = nn.Linear(128, 8)
+
+    def forward(self, x):
+        for block in self.blocks:
+            x = torch.relu(block(x))
+        return self.head(x)
+
+
+def build():
+    torch.manual_seed(0)
+    return Blocks()
+
+
+def steps(scale, mode, shape):
+    """Quantization step of every weight, one scale per row for int8 and per group for int4"""
+    scale = scale.float()
+    if mode == "int8":
+        return scale.expand(shape)
+    return scale.expand(-1, -1, GROUP_SIZE).reshape(shape)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_weights_round_trip_within_one_step(mode):
+    torch.manual_seed(0)
+    weight = torch.randn(32, 4 * GROUP_SIZE).to(torch.bfloat16)
+    qweight, scale = quantize_weight(weight, mode)
+    assert scale.dtype == torch.bfloat16
+    error = (dequantize_weight(qweight, scale, mode, torch.float32) - weight.float()).abs()
+    assert (error <= steps(scale, mode, error.shape)).all()
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_quantized_linear_runs_on_its_dequantized_weight(mode):
+    linear = build().blocks[0].to(torch.bfloat16)
+    layer = QuantizedLinear.from_linear(linear, mode)
+    x = torch.randn(4, 128, dtype=torch.bfloat16)
+    torch.testing.assert_close(layer(x), nn.functional.linear(x, layer.weight, linear.bias))
+
+
+def test_int4_needs_whole_groups():
+    with pytest.raises(ValueError):
+        QuantizedLinear(GROUP_SIZE + 1, 8, "int4")
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_checkpoint_loads_the_same_model(mode, tmp_path):
+    path = str(tmp_path / f"blocks-{mode}.safetensors")
+    quantized = load_quantized(path, lambda: build().to(torch.bfloat16), build, mode, ("blocks.",))
+    assert os.path.exists(path) and not os.path.exists(path + ".tmp")
+    loaded = load_quantized(path, None, build, mode, ("blocks.",))
+
+    assert all(isinstance(block, QuantizedLinear) for block in loaded.blocks)
+    assert type(loaded.head) is nn.Linear
+    assert model_bytes(loaded) < model_bytes(build().to(torch.bfloat16))
+    x = torch.randn(4, 128, dtype=torch.bfloat16)
+    with torch.no_grad():
+        assert torch.equal(loaded(x), quantized(x))
+
+
+def test_checkpoint_keeps_the_float32_layers_of_the_loaded_model(tmp_path):
+    """Like the T5 `wo` layers transformers keeps in float32 under torch_dtype=bfloat16"""
+    def load():
+        model = build().to(torch.bfloat16)
+        model.blocks[1].float()
+        return model
+
+    path = str(tmp_path / "mixed.safetensors")
+    quantized = load_quantized(path, load, build, "int8", ("blocks.",))
+    loaded = load_quantized(path, None, build, "int8", ("blocks.",))
+    assert loaded.blocks[1].scale.dtype == torch.float32
+    assert loaded.blocks[0].scale.dtype == torch.bfloat16
+    for name, tensor in quantized.state_dict().items():
+        assert loaded.state_dict()[name].dtype == tensor.dtype
+        assert torch.equal(loaded.state_dict()[name], tensor)
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_cache import ResultCache  # noqa: E402
+
+
+def test_keys_follow_the_pixels_and_parameters():
+    image = Image.new("RGB", (8, 8), "red")
+    key = ResultCache.make_key(image, seed=1, output=("webp", 90, (8, 8)))
+    assert ResultCache.make_key(image.copy(), output=("webp", 90, (8, 8)), seed=1) == key
+    assert ResultCache.make_key(image, seed=1, output=("jpeg", 90, (8, 8))) != key
+    assert ResultCache.make_key(Image.new("RGB", (8, 8), "blue"), seed=1, output=("webp", 90, (8, 8))) != key
+
+
+def test_bytes_are_served_from_memory_then_from_disk(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get("a") is None
+    written = cache.put("a", b"encoded")
+    assert cache.get("a") == b"encoded"
+    written.result()
+
+    reloaded = ResultCache(str(tmp_path))
+    assert reloaded.get("a") == b"encoded"
+    assert reloaded.stats()["bytes_used"] == len(b"encoded")
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path), max_entries=2, memory_entries=1)
+    for key in "abc":
+        cache.put(key, key.encode() * 4).result()
+        if key == "b":
+            assert cache.get("a") == b"aaaa"
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.stats()["evictions"] == 1
+    assert sorted(os.listdir(tmp_path)) == ["a.bin", "c.bin"]
@@ -0,0 +1,44 @@
+import os
+import sys
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import MicroBatchScheduler  # noqa: E402
+
+
+class Request:
+    def __init__(self, name):
+        self.name = name
+        self.cancelled = threading.Event()
+
+
+def test_requests_cancelled_while_queued_take_no_batch_slot():
+    batches = []
+    started, release = threading.Event(), threading.Event()
+
+    def run_batch(requests):
+        batches.append([request.name for request in requests])
+        started.set()
+        release.wait()
+        return [request.name for request in requests]
+
+    scheduler = MicroBatchScheduler(run_batch, max_batch_size=2, max_wait=0.0)
+    busy = scheduler.submit(Request("busy"))
+    started.wait()
+    requests = [Request(name) for name in "abcd"]
+    futures = [scheduler.submit(request) for request in requests]
+    requests[0].cancelled.set()
+    futures[2].cancel()
+    release.set()
+
+    assert busy.result(timeout=5) == "busy"
+    assert futures[1].result(timeout=5) == "b"
+    assert futures[3].result(timeout=5) == "d"
+    for future in (futures[0], futures[2]):
+        with pytest.raises(CancelledError):
+            future.result(timeout=5)
+    assert batches == [["busy"], ["b", "d"]]
@@ -0,0 +1,101 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from torch import nn  # noqa: E402
+
+from step_cache import StepCache  # noqa: E402
+
+
+class Block(nn.Module):
+    def __init__(self, seed):
+        super().__init__()
+        torch.manual_seed(seed)
+        self.linear = nn.Linear(8, 8)
+
+    def forward(self, hidden_states, encoder_hidden_states, **kwargs):
+        return encoder_hidden_states + 0.1 * kwargs["temb"], hidden_states + torch.tanh(self.linear(hidden_states)) * kwargs["temb"]
+
+
+class Transformer(nn.Module):
+    """The block layout of FluxTransformer2DModel, with blocks called the way it calls them"""
+
+    def __init__(self):
+        super().__init__()
+        self.transformer_blocks = nn.ModuleList([Block(seed) for seed in range(3)])
+        self.single_transformer_blocks = nn.ModuleList([Block(seed) for seed in range(3, 5)])
+
+    def forward(self, hidden_states, encoder_hidden_states, temb):
+        for block in list(self.transformer_blocks) + list(self.single_transformer_blocks):
+            encoder_hidden_states, hidden_states = block(hidden_states=hidden_states, encoder_hidden_states=encoder_hidden_states, temb=temb)
+        return hidden_states
+
+
+def denoise(transformer, steps, cache=None):
+    """A toy sampling loop whose inputs change less and less from one step to the next"""
+    if cache is not None:
+        cache.reset()
+    torch.manual_seed(0)
+    hidden_states = torch.randn(2, 16, 8)
+    encoder_hidden_states = torch.randn(2, 4, 8)
+    with torch.no_grad():
+        for step in range(steps):
+            temb = torch.tensor(1.0 / (step + 1))
+            hidden_states = hidden_states + 0.1 * transformer(hidden_states, encoder_hidden_states, temb)
+    return hidden_states
+
+
+def test_attach_and_detach_restore_the_blocks():
+    transformer = Transformer()
+    blocks = list(transformer.transformer_blocks)
+    single_blocks = list(transformer.single_transformer_blocks)
+    cache = StepCache().attach(transformer)
+    assert cache.cached_blocks == len(blocks) - 1 + len(single_blocks)
+    with pytest.raises(RuntimeError):
+        cache.attach(transformer)
+    cache.detach()
+    assert list(transformer.transformer_blocks) == blocks
+    assert list(transformer.single_transformer_blocks) == single_blocks
+
+
+def test_zero_threshold_is_exact():
+    transformer = Transformer()
+    reference = denoise(transformer, 12)
+    cache = StepCache(threshold=0.0).attach(transformer)
+    assert torch.equal(denoise(transformer, 12, cache), reference)
+    assert cache.stats()["skipped_steps"] == 0
+
+
+def test_threshold_skips_quiet_steps_and_stays_close():
+    transformer = Transformer()
+    reference = denoise(transformer, 12)
+    cache = StepCache(threshold=0.5, warmup=2, max_skips=2).attach(transformer)
+    output = denoise(transformer, 12, cache)
+    stats = cache.stats()
+    assert 0 < stats["skipped_steps"] <= 12 - 2
+    assert stats["skipped_blocks"] == stats["skipped_steps"] * cache.cached_blocks
+    assert (output - reference).abs().mean() / reference.abs().mean() < 0.05
+
+
+def test_reset_forgets_the_previous_call():
+    transformer = Transformer()
+    cache = StepCache(interval=2).attach(transformer)
+    first = denoise(transformer, 8, cache)
+    assert torch.equal(denoise(transformer, 8, cache), first)
+
+
+@pytest.mark.parametrize("interval, computed", [(4, [0, 1, 2, 6, 10, 14, 18, 22, 26]), (8, [0, 1, 2, 10, 18, 26])])
+def test_fixed_interval_is_not_capped_by_max_skips(interval, computed):
+    cache = StepCache(interval=interval, warmup=2, max_skips=3)
+    cache.residual = torch.zeros(1)
+    steps = []
+    for step in range(28):
+        cache._decide(torch.zeros(1))
+        if not cache.skip:
+            steps.append(step)
+    assert steps == computed
@@ -0,0 +1,69 @@
+import os
+import pickle
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+import metrics  # noqa: E402
+import pipeline  # noqa: E402
+from pipeline import RelightRequest, SweepRequest  # noqa: E402
+
+
+class SteppingStub(pipeline.StubPipeline):
+    """Calls the step callback like the real pipeline does"""
+
+    num_timesteps = 3
+
+    def __call__(self, *args, callback_on_step_end=None, **kwargs):
+        for step in range(self.num_timesteps):
+            callback_on_step_end(self, step, None, {})
+        return super().__call__(*args, **kwargs)
+
+
+def through_pickle(stream):
+    """What `spaces.GPU` does to a generator on ZeroGPU: pickles its arguments into a worker and every value it yields back"""
+    def run(requests):
+        for event in stream(pickle.loads(pickle.dumps(requests))):
+            yield pickle.loads(pickle.dumps(event))
+    return run
+
+
+@pytest.fixture(autouse=True)
+def stub():
+    pipeline.set_pipeline(SteppingStub())
+    yield
+    pipeline.set_pipeline(None)
+
+
+def test_requests_do_not_pickle_with_their_cancel_event():
+    with pytest.raises(TypeError):
+        pickle.dumps(RelightRequest(Image.new("RGB", (32, 32)), "prompt", 0, 2.5))
+
+
+def test_relayed_batch_feeds_callbacks_and_traces_in_this_process():
+    steps = {seed: [] for seed in range(2)}
+    requests = [
+        RelightRequest(Image.new("RGB", (32, 32), color), "prompt", seed, 2.5, trace=metrics.Trace(), on_step=lambda *step, seed=seed: steps[seed].append(step))
+        for seed, color in enumerate(("red", "blue"))
+    ]
+    images = pipeline.relay_batch(through_pickle(pipeline.stream_batch), requests)
+    assert steps == {seed: [(1, 3), (2, 3), (3, 3)] for seed in range(2)}
+    for request in requests:
+        assert "text_encoding" in request.trace.stages
+        assert len(request.trace.steps) == (3 if metrics.ENABLED else 0)
+    assert [image.tobytes() for image in images] == [image.tobytes() for image in pipeline.run_batch(requests)]
+
+
+def test_relayed_sweep_returns_one_image_per_variant_and_its_progress():
+    steps = []
+    sweep = SweepRequest(Image.new("RGB", (32, 32)), [("a", 0), ("b", 1), ("c", 2)], 2.5, on_step=lambda *step: steps.append(step))
+    [images] = pipeline.relay_batch(through_pickle(pipeline.stream_batch), [sweep])
+    assert len(images) == 3
+    assert steps == [(1, 3), (2, 3), (3, 3)]